@@ -1,7 +1,8 @@
 import re
+from compressed_io import open_input
 
 def read_and_parse_file(filename):
-    with open(filename, 'r') as file:
+    with open_input(filename) as file:  # Plain, gzip- or zstd-compressed input
         content = file.read()
 
     # Adjusting the regular expression to capture the full text for each entry
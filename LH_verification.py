@@ -1,7 +1,8 @@
 import re
+from compressed_io import open_input
 
 def verify_order(filename):
-    with open(filename, 'r') as file:
+    with open_input(filename) as file:  # Plain, gzip- or zstd-compressed input
         content = file.read()
 
     # Extracting the identifiers (L1, H1, etc.) from the entries
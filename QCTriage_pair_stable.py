@@ -1,7 +1,7 @@
 import openpyxl
 import tkinter as tk
 from tkinter import filedialog
-from Bio import SeqIO
+from fast_fasta import read_fasta, read_fasta_with_titles, write_fasta, write_fasta_record
 import re
 import os
 import glob
@@ -150,8 +150,8 @@ def process_antibody_data():
     for file_pattern in file_extensions:
         for fasta_file in glob.glob(os.path.join(fasta_file_dir, file_pattern)):
             # print(f"Reading file: {fasta_file}")  # Debug print to check if files are being read
-            for record in SeqIO.parse(fasta_file, "fasta"):
-                all_sequences.append(record)
+            for _, title, seq in read_fasta_with_titles(fasta_file):
+                all_sequences.append((title, seq))
             print(f"Found {len(all_sequences)} sequences after reading {fasta_file}")  # Debug print to check sequence accumulation
 
         
@@ -161,7 +161,7 @@ def process_antibody_data():
 
     # Save all sequences to a single FASTA file
     combined_fasta_path = os.path.join(output_dir, "Combined_sequences.fasta")
-    SeqIO.write(all_sequences, combined_fasta_path, "fasta")
+    write_fasta(all_sequences, combined_fasta_path)
 
 
     '''BEGIN PROCESSING COMBINED INPUT FILES'''
@@ -207,8 +207,8 @@ def process_antibody_data():
             debug_output.append(f"QC Entry: {template_name}, CRL: {crl}, QS: {qs}, Chain: {chain_type}, Chain Category: {category}")
 
     # Identify which FASTA sequences are missing QC entries (don't initialize yet since that throws off the debugging output)
-    for sequence in SeqIO.parse(combined_fasta_path, "fasta"):
-        base_id, full_id, chain_type = parse_identifier(sequence.id) # Parse FASTA sequence id strings   
+    for seq_id, seq in read_fasta(combined_fasta_path):
+        base_id, full_id, chain_type = parse_identifier(seq_id) # Parse FASTA sequence id strings   
         fasta_sequence_ids.add(full_id) # keep track of full_ID (i.e. specific chains)
         # print(f"debug: {full_id}")
         if base_id not in pairs: # a.k.a sequences that are missing QC entries
@@ -236,20 +236,20 @@ def process_antibody_data():
             debug_output.append(f"QC H/L Chain Pairing: {template_name}, Pair Category: {pair_category}, Determined by: {'H' if pairs[base_id]['b'] == pair_category else 'L'}")
 
     # Identify Pair Category for FASTA Pairs
-    for sequence in SeqIO.parse(combined_fasta_path, "fasta"):
-        base_id, full_id, chain_type = parse_identifier(sequence.id) # Parse FASTA sequence id strings      
+    for seq_id, seq in read_fasta(combined_fasta_path):
+        base_id, full_id, chain_type = parse_identifier(seq_id) # Parse FASTA sequence id strings      
         if base_id not in pairs: 
             pairs[base_id] = {'b': 7, 'a': 7}  # At this point, initialize missing pairs if not in pairs from Excel , these will be same as "pair missing QC entry"
         pair_category = max(pairs[base_id].values()) # Assign lower quality category (larger #) from between the heavy and light chain of the base_id 
-        seq_subsets[pair_category].append((sequence.id, str(sequence.seq))) # Add triaged sequence to category-specific FASTA file
-        debug_output.append(f"FASTA Sequence: {sequence.id}, Pair Category: {pair_category}")
+        seq_subsets[pair_category].append((seq_id, seq)) # Add triaged sequence to category-specific FASTA file
+        debug_output.append(f"FASTA Sequence: {seq_id}, Pair Category: {pair_category}")
     
     # Save sequences to separate output FASTA files in user-designated output directory
     for index, sequences in seq_subsets.items():
         file_name = f'Category_{index}_paired_sequences.fasta'
-        with open(os.path.join(output_dir, file_name), 'w') as file:
+        with open(os.path.join(output_dir, file_name), 'wb') as file:
             for seq_id, seq in sequences:
-                file.write(f'>{seq_id}\n{seq}\n')
+                write_fasta_record(file, seq_id, seq, wrap=None)
 
     category_counts = {i: 0 for i in range(1, 8)}  # Initialize counts to 0 for categories 1 to 7
 
@@ -0,0 +1,205 @@
+import argparse
+import os
+import re
+import numpy as np
+from fast_fasta import read_fasta
+from sequence_metrics import pack_sequences
+
+# Near-duplicate clonotype clustering of paired light + heavy chain sequences from the Category_N_paired_sequences.fasta outputs
+# Each pair is sketched with k-mer MinHash, candidate pairs are bucketed with LSH (banded signatures), and only candidates that
+# share a bucket are compared exactly (k-mer Jaccard similarity), so the run time grows near-linearly with the number of pairs
+KMER_SIZE = 16  # Nucleotides per k-mer (at most 31, the 2-bit k-mer code and chain tag have to fit in 64 bits)
+NUM_HASHES = 128  # MinHash signature length, power of 2 (one-permutation hashing: one hash split into NUM_HASHES bins)
+LSH_BANDS = 32  # Signature bands, NUM_HASHES / LSH_BANDS rows per band
+SIMILARITY_THRESHOLD = 0.5  # Minimum k-mer Jaccard similarity for two pairs to join the same cluster (~2-3% divergence at k=16)
+CLUSTER_CATEGORIES = (1,)  # Pair categories whose FASTA outputs are clustered
+CLUSTERS_FILE_NAME = 'Clonotype_clusters.tsv'
+CHUNK_BASES = 1 << 24  # Pairs are sketched in chunks of roughly this many bases to keep the k-mer arrays bounded
+KMER_CACHE_PAIRS = 20000  # Exact k-mer sets kept in memory for candidate comparisons (about 10 KB per pair)
+
+EMPTY_BIN = np.uint32(0xFFFFFFFF)  # Signature value of a bin without k-mers, bands containing one are not bucketed
+
+# 2-bit codes of A/C/G/T, 4 for ambiguous bases (k-mers containing them are skipped)
+_BASE_CODES = np.full(256, 4, dtype=np.uint8)
+for _code, _base in enumerate(b'ACGT'):
+    _BASE_CODES[_base] = _code
+
+# Same id convention as workflow.py: B1-b12 / B1-a12 -> (base_id B1-12, chain b/a)
+def chain_of(sequence_id):
+    match = re.match(r'^>?([\w-]+?)-?(b|a)(\d+)', sequence_id)
+    if match:
+        return f"{match.group(1)}-{match.group(3)}", match.group(2)
+    return None, None
+
+# splitmix64 finalizer, mixes k-mer codes into well distributed 64-bit hashes (uint64 arithmetic wraps)
+def _mix64(values):
+    values = values ^ (values >> np.uint64(30))
+    values = values * np.uint64(0xbf58476d1ce4e5b9)
+    values = values ^ (values >> np.uint64(27))
+    values = values * np.uint64(0x94d049bb133111eb)
+    return values ^ (values >> np.uint64(31))
+
+# Chain-tagged k-mer codes of packed records laid out as light, heavy, light, heavy, ...
+# Returns (codes, pair index of each code), skipping k-mers with ambiguous bases or that cross a record boundary
+def _pair_kmers(sequences, k=KMER_SIZE):
+    buffer, offsets = pack_sequences(sequences)
+    n = len(buffer) - k + 1
+    if n <= 0:
+        return np.zeros(0, dtype=np.uint64), np.zeros(0, dtype=np.int64)
+    bases = _BASE_CODES[buffer]
+    codes = np.zeros(n, dtype=np.uint64)
+    for j in range(k):
+        codes <<= np.uint64(2)
+        codes |= bases[j:j + n] & 3
+    ambiguous_count = np.zeros(len(bases) + 1, dtype=np.int64)
+    np.cumsum(bases > 3, out=ambiguous_count[1:])
+    record = np.repeat(np.arange(len(offsets) - 1), np.diff(offsets))[:n]
+    valid = (ambiguous_count[k:] == ambiguous_count[:n]) & (np.arange(n) + k <= offsets[record + 1])
+    record = record[valid]
+    codes = codes[valid] | ((record & 1).astype(np.uint64) << np.uint64(2 * k))  # Tag heavy chain k-mers so chains never share k-mers
+    return codes, record // 2
+
+# MinHash signatures (pairs x NUM_HASHES, uint32) of (light, heavy) sequence pairs, using one-permutation hashing
+def minhash_signatures(light_sequences, heavy_sequences, k=KMER_SIZE, num_hashes=NUM_HASHES, chunk_bases=CHUNK_BASES):
+    signatures = np.full((len(light_sequences), num_hashes), EMPTY_BIN, dtype=np.uint32)
+    start = 0
+    while start < len(light_sequences):
+        # Grow the chunk until it holds about chunk_bases bases
+        end, bases = start, 0
+        while end < len(light_sequences) and (end == start or bases < chunk_bases):
+            bases += len(light_sequences[end]) + len(heavy_sequences[end])
+            end += 1
+        interleaved = [seq for pair in zip(light_sequences[start:end], heavy_sequences[start:end]) for seq in pair]
+        codes, pair_index = _pair_kmers(interleaved, k)
+        hashes = _mix64(codes)
+        keys = pair_index * num_hashes + (hashes % np.uint64(num_hashes)).astype(np.int64)
+        # Minimum hash value per (pair, bin)
+        np.minimum.at(signatures[start:end].reshape(-1), keys, (hashes >> np.uint64(32)).astype(np.uint32))
+        start = end
+    return signatures
+
+# Exact chain-tagged k-mer set of one pair, sorted
+def pair_kmer_set(light_sequence, heavy_sequence, k=KMER_SIZE):
+    codes, _ = _pair_kmers([light_sequence, heavy_sequence], k)
+    codes.sort()
+    return np.concatenate((codes[:1], codes[1:][codes[1:] != codes[:-1]]))
+
+def jaccard_similarity(kmers_1, kmers_2):
+    union = len(kmers_1) + len(kmers_2)
+    if union == 0:
+        return 0.0
+    shared = len(np.intersect1d(kmers_1, kmers_2, assume_unique=True))
+    return shared / (union - shared)
+
+# Candidate groups of pairs sharing an LSH bucket in any band (bands with empty bins are skipped)
+def lsh_buckets(signatures, bands=LSH_BANDS):
+    rows = signatures.shape[1] // bands
+    for band in range(bands):
+        band_values = np.ascontiguousarray(signatures[:, band * rows:(band + 1) * rows])
+        members = np.flatnonzero(~(band_values == EMPTY_BIN).any(axis=1))
+        if len(members) < 2:
+            continue
+        band_keys = band_values[members].view(np.dtype((np.void, rows * band_values.itemsize))).ravel()
+        _, bucket, counts = np.unique(band_keys, return_inverse=True, return_counts=True)
+        shared = counts[bucket] > 1
+        members, bucket = members[shared], bucket[shared]
+        order = np.argsort(bucket, kind='stable')
+        members, bucket = members[order], bucket[order]
+        boundaries = np.flatnonzero(bucket[1:] != bucket[:-1]) + 1
+        yield from np.split(members, boundaries)
+
+# Cluster (light, heavy) sequence pairs into near-duplicate clonotypes
+# Returns one cluster label per pair; clusters are numbered from 1 by decreasing size, then by first member
+def cluster_pairs(light_sequences, heavy_sequences, threshold=SIMILARITY_THRESHOLD, k=KMER_SIZE, num_hashes=NUM_HASHES, bands=LSH_BANDS):
+    n_pairs = len(light_sequences)
+    signatures = minhash_signatures(light_sequences, heavy_sequences, k, num_hashes)
+    parents = list(range(n_pairs))
+
+    def find(i):
+        while parents[i] != i:
+            parents[i] = parents[parents[i]]
+            i = parents[i]
+        return i
+
+    kmer_sets = {}
+    def kmers(i):
+        if i not in kmer_sets:
+            if len(kmer_sets) >= KMER_CACHE_PAIRS:
+                kmer_sets.clear()
+            kmer_sets[i] = pair_kmer_set(light_sequences[i], heavy_sequences[i], k)
+        return kmer_sets[i]
+
+    # Exact comparisons only within buckets: the members are collapsed to their distinct clusters, and each cluster is compared
+    # once (through its first member in the bucket) against the bucket's first member, so a bucket costs one comparison per cluster
+    for bucket in lsh_buckets(signatures, bands):
+        members = {}  # cluster root -> first member of the cluster in this bucket
+        for i in bucket.tolist():
+            members.setdefault(find(i), i)
+        if len(members) < 2:
+            continue
+        members = iter(members.values())
+        anchor = next(members)
+        for i in members:
+            root_anchor, root_i = find(anchor), find(i)
+            if root_anchor != root_i and jaccard_similarity(kmers(anchor), kmers(i)) >= threshold:
+                parents[max(root_anchor, root_i)] = min(root_anchor, root_i)
+
+    roots = np.array([find(i) for i in range(n_pairs)], dtype=np.int64)
+    _, first_member, inverse, sizes = np.unique(roots, return_index=True, return_inverse=True, return_counts=True)
+    ranking = np.lexsort((first_member, -sizes))  # Largest clusters first
+    labels = np.empty(len(ranking), dtype=np.int64)
+    labels[ranking] = np.arange(1, len(ranking) + 1)
+    return labels[inverse]
+
+# Read complete (light + heavy) pairs from the Category_N_paired_sequences.fasta files of the given categories
+# Returns [(base_id, category, light sequence, heavy sequence)] in file order, plus the number of incomplete pairs skipped
+def read_category_pairs(output_dir, categories=CLUSTER_CATEGORIES):
+    chains = {}
+    for category in categories:
+        fasta_path = os.path.join(output_dir, f'Category_{category}_paired_sequences.fasta')
+        if not os.path.exists(fasta_path):
+            continue
+        for seq_id, seq in read_fasta(fasta_path):
+            base_id, chain_type = chain_of(seq_id)
+            if base_id:
+                chains.setdefault(base_id, {'category': category}).setdefault(chain_type, seq)
+    pairs = [(base_id, pair['category'], pair['a'], pair['b']) for base_id, pair in chains.items() if 'a' in pair and 'b' in pair]
+    return pairs, len(chains) - len(pairs)
+
+# Cluster the pairs of the given categories and write Clonotype_clusters.tsv next to the category outputs
+# The summary line is printed, and appended to debug_output when given (e.g. the triage log lines)
+# Returns (number of pairs clustered, number of clusters, number of pairs in multi-member clusters)
+def cluster_category_files(output_dir, categories=CLUSTER_CATEGORIES, threshold=SIMILARITY_THRESHOLD, debug_output=None):
+    pairs, incomplete = read_category_pairs(output_dir, categories)
+    labels = cluster_pairs([light for _, _, light, _ in pairs], [heavy for _, _, _, heavy in pairs], threshold)
+    sizes = np.bincount(labels)
+    representatives = {}
+    for (base_id, _, _, _), label in zip(pairs, labels):
+        representatives.setdefault(label, base_id)
+
+    with open(os.path.join(output_dir, CLUSTERS_FILE_NAME), 'w') as clusters_file:
+        clusters_file.write("Cluster\tCluster Size\tBase ID\tPair Category\tRepresentative\n")
+        for index in np.lexsort((np.arange(len(pairs)), labels)):  # Grouped by cluster, members in file order
+            base_id, category, _, _ = pairs[index]
+            label = labels[index]
+            clusters_file.write(f"{label}\t{sizes[label]}\t{base_id}\t{category}\t{representatives[label]}\n")
+
+    clustered_pairs = int(sizes[sizes > 1].sum())
+    summary = (f"Clustered {len(pairs)} pairs of Category {', '.join(map(str, categories))} into {len(representatives)} clonotype clusters "
+               f"({clustered_pairs} pairs in shared clusters, {incomplete} incomplete pairs skipped)")
+    print(summary)
+    if debug_output is not None:
+        debug_output.append(summary)
+    return len(pairs), len(representatives), clustered_pairs
+
+# Command line: python clonotype_clusters.py OUTPUT_DIR [--categories 1 2] [--threshold 0.5]
+def main():
+    parser = argparse.ArgumentParser(description='Cluster near-duplicate paired sequences of triage category outputs into clonotypes')
+    parser.add_argument('output_dir', help='Triage output directory containing the Category_N_paired_sequences.fasta files')
+    parser.add_argument('--categories', type=int, nargs='+', default=list(CLUSTER_CATEGORIES), help='Pair categories to cluster')
+    parser.add_argument('--threshold', type=float, default=SIMILARITY_THRESHOLD, help='Minimum k-mer Jaccard similarity within a cluster')
+    args = parser.parse_args()
+    cluster_category_files(args.output_dir, args.categories, args.threshold)
+
+if __name__ == "__main__":
+    main()
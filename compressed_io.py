@@ -0,0 +1,115 @@
+import gzip
+import io
+import queue
+import threading
+
+try:
+    import zstandard  # Optional, only needed for .zst inputs
+except ImportError:
+    zstandard = None
+
+GZIP_MAGIC = b'\x1f\x8b'
+ZSTD_MAGIC = b'\x28\xb5\x2f\xfd'
+COMPRESSED_EXTENSIONS = ('.gz', '.zst')
+READ_CHUNK_SIZE = 1 << 20  # Bytes decompressed per chunk by the reader thread
+QUEUE_CHUNKS = 8  # Decompressed chunks buffered ahead of the parser
+
+# Glob patterns matching plain and compressed variants of the given patterns (e.g. '*.fasta' -> '*.fasta.gz', '*.fasta.zst')
+def compressed_patterns(patterns):
+    return [pattern + extension for pattern in patterns for extension in ('',) + COMPRESSED_EXTENSIONS]
+
+# Remove a trailing .gz/.zst so output names and file type checks use the inner file name
+def strip_compression_extension(file_path):
+    for extension in COMPRESSED_EXTENSIONS:
+        if file_path.endswith(extension):
+            return file_path[:-len(extension)]
+    return file_path
+
+# Detect the compression of a file from its magic bytes: 'gzip', 'zstd' or None for plain files
+def compression_type(file_path):
+    with open(file_path, 'rb') as file:
+        magic = file.read(4)
+    if magic.startswith(GZIP_MAGIC):
+        return 'gzip'
+    if magic == ZSTD_MAGIC:
+        return 'zstd'
+    return None
+
+def _open_decompressing_stream(file_path, compression):
+    if compression == 'gzip':
+        return gzip.open(file_path, 'rb')
+    if zstandard is None:
+        raise ImportError(f"Reading zstd-compressed input {file_path} requires the zstandard package (pip install zstandard)")
+    return zstandard.ZstdDecompressor().stream_reader(open(file_path, 'rb'), read_across_frames=True, closefd=True)
+
+# Raw binary stream that decompresses in a background thread and hands chunks to the reading (parsing) thread through a bounded queue
+class ThreadedDecompressor(io.RawIOBase):
+    def __init__(self, source):
+        self._source = source
+        self._chunks = queue.Queue(maxsize=QUEUE_CHUNKS)
+        self._pending = b''
+        self._eof = False
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._decompress, daemon=True)
+        self._thread.start()
+
+    def _decompress(self):
+        try:
+            while not self._stopped.is_set():
+                chunk = self._source.read(READ_CHUNK_SIZE)
+                self._put(chunk)
+                if not chunk:
+                    return
+        except Exception as e:
+            self._put(e)
+
+    # Put with a timeout so the thread notices close() even when the queue is full
+    def _put(self, item):
+        while not self._stopped.is_set():
+            try:
+                self._chunks.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        while not self._pending and not self._eof:
+            chunk = self._chunks.get()
+            if isinstance(chunk, Exception):
+                raise chunk
+            if not chunk:
+                self._eof = True
+            self._pending = memoryview(chunk)
+        size = min(len(buffer), len(self._pending))
+        buffer[:size] = self._pending[:size]
+        self._pending = self._pending[size:]
+        return size
+
+    def close(self):
+        if not self.closed:
+            self._stopped.set()
+            self._thread.join()
+            self._source.close()
+        super().close()
+
+# Open an input file that may be plain, gzip- or zstd-compressed (detected from its magic bytes)
+# Compressed files are stream-decompressed on the fly, in a separate thread when threaded=True, without temporary copies
+# mode is 'r' for text or 'rb' for binary, like open()
+def open_input(file_path, mode='r', threaded=True):
+    compression = compression_type(file_path)
+    if compression is None:
+        return open(file_path, mode)
+    stream = _open_decompressing_stream(file_path, compression)
+    if threaded:
+        stream = io.BufferedReader(ThreadedDecompressor(stream), buffer_size=READ_CHUNK_SIZE)
+    if 'b' in mode:
+        return stream
+    return io.TextIOWrapper(stream)
+
+# Read a whole (possibly compressed) binary file into a seekable in-memory buffer, e.g. for openpyxl or pandas
+def read_input_bytes(file_path):
+    with open_input(file_path, 'rb', threaded=False) as file:
+        return io.BytesIO(file.read())
@@ -0,0 +1,105 @@
+import io
+import os
+
+try:
+    from Bio import SeqIO  # Optional, only used when FASTA_BACKEND = 'biopython'
+    from Bio.Seq import Seq
+    from Bio.SeqRecord import SeqRecord
+except ImportError:
+    SeqIO = None
+
+# 'builtin' uses the line scanner below, 'biopython' falls back to Bio.SeqIO (same records, slower)
+FASTA_BACKEND = 'builtin'
+READ_CHUNK_SIZE = 1 << 20  # Bytes read per buffered read
+FASTA_WRAP = 60  # Sequence line length of written FASTA files, as written by SeqIO
+NEWLINE = os.linesep.encode()  # Written line ending, matching text mode files (\r\n on Windows)
+_SEQUENCE_WHITESPACE = b' \t\r\n'  # Removed from sequence lines, like SeqIO's fasta parser
+
+
+# Split one record's text (title line and sequence lines, without the leading '>') into (title, sequence bytes)
+def _split_record(text):
+    title, _, sequence = text.partition(b'\n')
+    return title.decode().rstrip(), sequence.translate(None, _SEQUENCE_WHITESPACE)
+
+# Yield (title, sequence bytes) for every record of a binary FASTA stream, using large buffered reads
+# Multi-line records and blank lines are handled like SeqIO.parse(handle, 'fasta'): sequence lines are joined with
+# all whitespace removed, and a file that does not start with '>' (comments or blank lines before the first record) is rejected
+def _parse_titles(handle):
+    pending = handle.read(READ_CHUNK_SIZE)
+    if not pending:
+        return
+    if not pending.startswith(b'>'):
+        raise ValueError("This FASTA file contains comments or blank lines at the beginning of the file, which are not allowed by the 'fasta' parser.")
+    pending = pending[1:]
+    while True:
+        chunk = handle.read(READ_CHUNK_SIZE)
+        if not chunk:
+            break
+        # Only records followed by the next '>' title line are known to be complete
+        search_start = max(len(pending) - 1, 0)
+        pending += chunk
+        cut = pending.rfind(b'\n>', search_start)
+        if cut == -1:
+            continue
+        for text in pending[:cut].split(b'\n>'):
+            yield _split_record(text)
+        pending = pending[cut + 2:]
+    for text in pending.split(b'\n>'):
+        yield _split_record(text)
+
+# Biopython fallback with the same output as _parse_titles
+def _parse_titles_biopython(handle):
+    if SeqIO is None:
+        raise ImportError("FASTA_BACKEND = 'biopython' requires Biopython (pip install biopython)")
+    for record in SeqIO.parse(io.TextIOWrapper(handle), 'fasta'):
+        yield record.description, bytes(record.seq)
+
+def _records(source):
+    parse = _parse_titles_biopython if FASTA_BACKEND == 'biopython' else _parse_titles
+    if isinstance(source, (str, os.PathLike)):
+        with open(source, 'rb') as handle:
+            yield from parse(handle)
+    else:
+        yield from parse(source)
+
+# Record id: first word of the title, or '' for an empty title (as SeqRecord.id)
+def _title_id(title):
+    words = title.split(None, 1)
+    return words[0] if words else ''
+
+# Yield (id, sequence bytes) for every record of a FASTA file path or binary stream
+def read_fasta(source):
+    for title, sequence in _records(source):
+        yield _title_id(title), sequence
+
+# Yield (id, title, sequence bytes) for every record, keeping the full title line for writing the records back out
+def read_fasta_with_titles(source):
+    for title, sequence in _records(source):
+        yield _title_id(title), title, sequence
+
+# Bytes of one record, wrapping the sequence like SeqIO.write (wrap=None writes a single sequence line)
+def format_fasta_record(title, sequence, wrap=FASTA_WRAP):
+    if isinstance(sequence, str):
+        sequence = sequence.encode()
+    if wrap:
+        return b'>' + title.encode() + NEWLINE + b''.join(sequence[i:i + wrap] + NEWLINE for i in range(0, len(sequence), wrap))
+    return b'>' + title.encode() + NEWLINE + sequence + NEWLINE
+
+# Write one record to a binary stream
+def write_fasta_record(handle, title, sequence, wrap=FASTA_WRAP):
+    handle.write(format_fasta_record(title, sequence, wrap))
+
+# Write (title, sequence) records to a FASTA file, with the same output as SeqIO.write(records, path, 'fasta')
+# Returns the number of records written
+def write_fasta(records, path, wrap=FASTA_WRAP):
+    if FASTA_BACKEND == 'biopython':
+        if SeqIO is None:
+            raise ImportError("FASTA_BACKEND = 'biopython' requires Biopython (pip install biopython)")
+        seq_records = (SeqRecord(Seq(sequence), id=_title_id(title), description=title) for title, sequence in records)
+        return SeqIO.write(seq_records, path, 'fasta')
+    count = 0
+    with open(path, 'wb', buffering=READ_CHUNK_SIZE) as handle:
+        for title, sequence in records:
+            write_fasta_record(handle, title, sequence, wrap)
+            count += 1
+    return count
@@ -0,0 +1,90 @@
+import hashlib
+import json
+import os
+import shutil
+from collections import OrderedDict
+from fast_fasta import format_fasta_record
+
+# Partitioned category x prefix (box) FASTA layout, written alongside the Category_N_paired_sequences.fasta files:
+#   partitioned_sequences/Category_1/B1.fasta, partitioned_sequences/Category_1/B3.fasta, ...
+#   partitioned_sequences/manifest.json listing every shard's record count, byte size and SHA-256 checksum
+# so downstream jobs can pick single shards (e.g. category 1 of box B3) and verify them without scanning the combined files
+SHARD_DIR_NAME = 'partitioned_sequences'
+MANIFEST_FILE_NAME = 'manifest.json'
+UNASSIGNED_PREFIX = 'unassigned'  # Shard name for records whose id has no box prefix
+MAX_OPEN_SHARDS = 128  # Shard files kept open at once, least recently written shards are closed and reopened for appending
+
+
+# Streaming writer of one record at a time into its (category, prefix) shard
+# Record counts, sizes and checksums are accumulated while writing, so the manifest needs no second pass over the shards
+class FastaShardWriter:
+    def __init__(self, output_dir):
+        self.shard_dir = os.path.join(output_dir, SHARD_DIR_NAME)
+        shutil.rmtree(self.shard_dir, ignore_errors=True)  # Drop shards of an earlier run into the same output directory
+        self.shards = {}  # (category, prefix) -> {'path', 'records', 'bytes', 'sha256'}
+        self.open_files = OrderedDict()  # (category, prefix) -> open file, in least recently written order
+
+    def _file(self, key):
+        if key in self.open_files:
+            self.open_files.move_to_end(key)
+            return self.open_files[key]
+        if len(self.open_files) >= MAX_OPEN_SHARDS:
+            _, oldest = self.open_files.popitem(last=False)
+            oldest.close()
+        category, prefix = key
+        if key not in self.shards:
+            relative_path = os.path.join(f'Category_{category}', f'{prefix}.fasta')
+            os.makedirs(os.path.join(self.shard_dir, f'Category_{category}'), exist_ok=True)
+            self.shards[key] = {'path': relative_path, 'records': 0, 'bytes': 0, 'sha256': hashlib.sha256()}
+            mode = 'wb'
+        else:
+            mode = 'ab'
+        self.open_files[key] = open(os.path.join(self.shard_dir, self.shards[key]['path']), mode)
+        return self.open_files[key]
+
+    # Append one record (same unwrapped format as the Category_N_paired_sequences.fasta files) to its shard
+    def write(self, category, prefix, seq_id, seq):
+        key = (int(category), prefix or UNASSIGNED_PREFIX)
+        record = format_fasta_record(seq_id, seq, wrap=None)
+        self._file(key).write(record)
+        shard = self.shards[key]
+        shard['records'] += 1
+        shard['bytes'] += len(record)
+        shard['sha256'].update(record)
+
+    # Close all shards and write the manifest, returning its path
+    def close(self):
+        for file in self.open_files.values():
+            file.close()
+        self.open_files.clear()
+        os.makedirs(self.shard_dir, exist_ok=True)
+        shards = [{'category': category, 'prefix': prefix, 'path': shard['path'].replace(os.sep, '/'), 'records': shard['records'],
+                   'bytes': shard['bytes'], 'sha256': shard['sha256'].hexdigest()}
+                  for (category, prefix), shard in sorted(self.shards.items())]
+        manifest = {'layout': 'Category_<category>/<prefix>.fasta', 'total_records': sum(shard['records'] for shard in shards),
+                    'total_bytes': sum(shard['bytes'] for shard in shards), 'shards': shards}
+        manifest_path = os.path.join(self.shard_dir, MANIFEST_FILE_NAME)
+        temp_path = manifest_path + '.tmp'
+        with open(temp_path, 'w') as manifest_file:
+            json.dump(manifest, manifest_file, indent=2)
+        os.replace(temp_path, manifest_path)  # The manifest only appears once every shard is complete
+        return manifest_path
+
+# Read a shard manifest, optionally restricted to some categories and/or prefixes
+# Returns the selected shard entries with their absolute paths
+def select_shards(output_dir, categories=None, prefixes=None):
+    shard_dir = os.path.join(output_dir, SHARD_DIR_NAME)
+    with open(os.path.join(shard_dir, MANIFEST_FILE_NAME)) as manifest_file:
+        manifest = json.load(manifest_file)
+    return [dict(shard, path=os.path.join(shard_dir, shard['path'])) for shard in manifest['shards']
+            if (categories is None or shard['category'] in categories) and (prefixes is None or shard['prefix'] in prefixes)]
+
+# Check a shard's size and checksum against its manifest entry
+def verify_shard(shard):
+    digest = hashlib.sha256()
+    size = 0
+    with open(shard['path'], 'rb') as shard_file:
+        for chunk in iter(lambda: shard_file.read(1 << 20), b''):
+            digest.update(chunk)
+            size += len(chunk)
+    return size == shard['bytes'] and digest.hexdigest() == shard['sha256']
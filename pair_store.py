@@ -0,0 +1,96 @@
+import numpy as np
+
+MAX_CATEGORY = 7  # Categories range from 1 to 7, 7 meaning missing/unusable
+HEAVY_FASTA = 1  # fasta_chains bit flag: heavy chain (b) sequence present in FASTA
+LIGHT_FASTA = 2  # fasta_chains bit flag: light chain (a) sequence present in FASTA
+
+
+# Compact heavy/light category store for every base_id in a triage run
+# base_ids are interned to integer indices (in first-seen order, matching the old pairs dict insertion order)
+# and the per-pair state lives in small NumPy arrays instead of one {'b': 7, 'a': 7} dict per pair:
+#   heavy / light  uint8 chain categories (initialized to Category 7)
+#   prefix_codes   uint16 code of the box prefix (e.g. B1), names in prefix_names
+#   fasta_chains   uint8 bit flags recording which chains were seen in FASTA
+class PairStore:
+    def __init__(self, capacity=1024):
+        self.index = {}  # base_id -> integer index
+        self.base_ids = []  # integer index -> base_id
+        self.prefix_index = {}  # prefix -> prefix code
+        self.prefix_names = []  # prefix code -> prefix
+        self.heavy = np.full(capacity, MAX_CATEGORY, dtype=np.uint8)
+        self.light = np.full(capacity, MAX_CATEGORY, dtype=np.uint8)
+        self.prefix_codes = np.zeros(capacity, dtype=np.uint16)
+        self.fasta_chains = np.zeros(capacity, dtype=np.uint8)
+
+    def __len__(self):
+        return len(self.base_ids)
+
+    def __contains__(self, base_id):
+        return base_id in self.index
+
+    # Double the array capacity when full
+    def _grow(self):
+        capacity = len(self.heavy) * 2
+        self.heavy = np.concatenate([self.heavy, np.full(capacity - len(self.heavy), MAX_CATEGORY, dtype=np.uint8)])
+        self.light = np.concatenate([self.light, np.full(capacity - len(self.light), MAX_CATEGORY, dtype=np.uint8)])
+        self.prefix_codes = np.concatenate([self.prefix_codes, np.zeros(capacity - len(self.prefix_codes), dtype=np.uint16)])
+        self.fasta_chains = np.concatenate([self.fasta_chains, np.zeros(capacity - len(self.fasta_chains), dtype=np.uint8)])
+
+    # Return the index of base_id, adding it as a new Category 7/7 pair if it is not stored yet
+    def add(self, base_id):
+        idx = self.index.get(base_id)
+        if idx is None:
+            idx = len(self.base_ids)
+            if idx == len(self.heavy):
+                self._grow()
+            prefix = base_id.split('-')[0]
+            if prefix not in self.prefix_index:
+                self.prefix_index[prefix] = len(self.prefix_names)
+                self.prefix_names.append(prefix)
+            self.index[base_id] = idx
+            self.base_ids.append(base_id)
+            self.prefix_codes[idx] = self.prefix_index[prefix]
+        return idx
+
+    # Keep the highest quality category (smallest #) seen for a chain across multiple reads
+    def update_chain(self, idx, chain_type, category):
+        chain = self.heavy if chain_type == 'b' else self.light
+        chain[idx] = min(chain[idx], category)
+
+    # Force a chain back to Category 7 (e.g. QC entry with no matching FASTA sequence)
+    def reset_chain(self, idx, chain_type):
+        chain = self.heavy if chain_type == 'b' else self.light
+        chain[idx] = MAX_CATEGORY
+
+    # Record that a chain of a stored pair has a FASTA sequence
+    def mark_fasta(self, idx, chain_type):
+        self.fasta_chains[idx] |= HEAVY_FASTA if chain_type == 'b' else LIGHT_FASTA
+
+    # Pair category of one stored pair: the lower quality category (larger #) of its heavy and light chain
+    def pair_category(self, idx):
+        return int(max(self.heavy[idx], self.light[idx]))
+
+    # Pair categories of every stored pair as one uint8 array
+    def pair_categories(self):
+        n = len(self)
+        return np.maximum(self.heavy[:n], self.light[:n])
+
+    # Iterate (base_id, heavy category, light category) in insertion order
+    def items(self):
+        for idx, base_id in enumerate(self.base_ids):
+            yield base_id, int(self.heavy[idx]), int(self.light[idx])
+
+    # Pair counts per prefix as {prefix: {category: count}}, in first-seen prefix order
+    def prefix_category_counts(self):
+        n = len(self)
+        counts = np.zeros((len(self.prefix_names), MAX_CATEGORY + 1), dtype=np.int64)
+        np.add.at(counts, (self.prefix_codes[:n], self.pair_categories()), 1)
+        return {prefix: {category: int(counts[code, category]) for category in range(1, MAX_CATEGORY + 1)}
+                for code, prefix in enumerate(self.prefix_names)}
+
+    # Heavy x light category frequency matrices per prefix, indexed [heavy - 1, light - 1]
+    def quality_matrices(self):
+        n = len(self)
+        matrices = np.zeros((len(self.prefix_names), MAX_CATEGORY, MAX_CATEGORY))
+        np.add.at(matrices, (self.prefix_codes[:n], self.heavy[:n].astype(np.intp) - 1, self.light[:n].astype(np.intp) - 1), 1)
+        return {prefix: matrices[code] for code, prefix in enumerate(self.prefix_names)}
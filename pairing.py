@@ -1,6 +1,21 @@
+import os
+import glob
+import hashlib
+import json
+import argparse
 import pandas as pd
 import tkinter as tk
 from tkinter import filedialog
+from triage_index import upsert_clones
+
+# Optional SQLite index (see triage_index.py) that clone number mappings are upserted into, e.g. 'triage_index.sqlite'
+TRIAGE_INDEX_DB = None
+# The cleaned light/heavy chain ID -> Clone# map is cached as JSON in a per-user local cache directory (not next to the registry,
+# which usually sits on a shared drive) and rebuilt when the registry changes
+CLONE_MAP_CACHE = True
+CLONE_MAP_CACHE_VERSION = 2
+CLONE_MAP_CACHE_DIR = None  # None: %LOCALAPPDATA%\My-Scripts\clone_maps on Windows, $XDG_CACHE_HOME (or ~/.cache)/My-Scripts/clone_maps elsewhere
+QC_OUTPUT_SUFFIX = '_with_CloneNumbers'  # Batch mode output: <QC file name>_with_CloneNumbers.xlsx
 
 def load_file(prompt):
     root = tk.Tk()
@@ -14,28 +29,121 @@ def save_file():
     directory = filedialog.askdirectory(title="Select output directory")
     return directory
 
-def process_files(hybridoma_path, qc_path):
-    # Load data
+# Build the chain ID -> Clone# map from the hybridoma registry
+def build_clone_map(hybridoma_path):
     hybridoma_data = pd.read_excel(hybridoma_path)
-    qc_data = pd.read_excel(qc_path)
 
     # Clean up the data for accurate matching
     hybridoma_data['Azenta sequence ID'] = hybridoma_data['Azenta sequence ID'].str.strip()
     hybridoma_data['Unnamed: 6'] = hybridoma_data['Unnamed: 6'].str.strip()
-    qc_data['DNAName'] = qc_data['DNAName'].str.strip()
 
     # Create a dictionary for Light Chain IDs
     light_chain_map = hybridoma_data.set_index('Azenta sequence ID')['Unnamed: 3'].to_dict()
     # Create a dictionary for Heavy Chain IDs
     heavy_chain_map = hybridoma_data.set_index('Unnamed: 6')['Unnamed: 3'].to_dict()
 
-    # Append Clone# using Light Chain ID and Heavy Chain ID maps
-    qc_data['Clone#'] = qc_data['DNAName'].apply(lambda x: light_chain_map.get(x, heavy_chain_map.get(x)))
+    # Light Chain IDs take precedence over Heavy Chain IDs; blank (non-text) IDs are dropped
+    return {chain_id: clone for chain_id, clone in {**heavy_chain_map, **light_chain_map}.items() if isinstance(chain_id, str)}
+
+def clone_map_cache_dir():
+    if CLONE_MAP_CACHE_DIR:
+        return CLONE_MAP_CACHE_DIR
+    if os.name == 'nt':
+        base = os.environ.get('LOCALAPPDATA') or os.path.join(os.path.expanduser('~'), 'AppData', 'Local')
+    else:
+        base = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(base, 'My-Scripts', 'clone_maps')
 
+# One cache file per registry, named after a hash of the registry's absolute path
+def clone_map_cache_path(hybridoma_path):
+    registry_path = os.path.abspath(hybridoma_path)
+    digest = hashlib.sha256(registry_path.encode()).hexdigest()[:16]
+    return os.path.join(clone_map_cache_dir(), f'{os.path.basename(registry_path)}.{digest}.json')
+
+# Load the clone map from its cache when the registry file is unchanged (same path, modification time and size), otherwise rebuild and re-cache it
+def load_clone_map(hybridoma_path, use_cache=CLONE_MAP_CACHE):
+    if not use_cache:
+        return build_clone_map(hybridoma_path)
+    stat = os.stat(hybridoma_path)
+    signature = [CLONE_MAP_CACHE_VERSION, os.path.abspath(hybridoma_path), stat.st_mtime_ns, stat.st_size]
+    cache_path = clone_map_cache_path(hybridoma_path)
+    try:
+        with open(cache_path, encoding='utf-8') as cache_file:
+            cached = json.load(cache_file)
+        if cached['signature'] == signature:
+            return cached['clone_map']
+    except (OSError, ValueError, KeyError, TypeError):
+        pass  # Missing, stale or unreadable cache
+
+    clone_map = build_clone_map(hybridoma_path)
+    temp_path = cache_path + '.tmp'
+    try:
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        with open(temp_path, 'w', encoding='utf-8') as cache_file:
+            json.dump({'signature': signature, 'clone_map': clone_map}, cache_file)
+        os.replace(temp_path, cache_path)
+    except (OSError, TypeError, ValueError) as e:  # TypeError: clone numbers that JSON cannot store, the map is then used uncached
+        print(f"Could not cache the clone map of {hybridoma_path}: {e}")
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+    return clone_map
+
+# Append Clone# to a QC workbook using the Light Chain ID and Heavy Chain ID map
+def annotate_qc_file(clone_map, qc_path):
+    qc_data = pd.read_excel(qc_path)
+    qc_data['DNAName'] = qc_data['DNAName'].str.strip()
+    qc_data['Clone#'] = qc_data['DNAName'].apply(lambda x: clone_map.get(x) if isinstance(x, str) else None)
     return qc_data
 
-def main():
-    hybridoma_path = load_file("Select the Hybridoma Excel File")
+def process_files(hybridoma_path, qc_path):
+    return annotate_qc_file(load_clone_map(hybridoma_path), qc_path)
+
+# Annotate every QC workbook in a directory against one registry load
+# Outputs are written as <QC file name>_with_CloneNumbers.xlsx; outputs of earlier runs are skipped
+def batch_annotate(hybridoma_path, qc_dir, output_dir, index_db=TRIAGE_INDEX_DB):
+    clone_map = load_clone_map(hybridoma_path)
+    qc_paths = sorted(path for pattern in ('*.xlsx', '*.xls') for path in glob.glob(os.path.join(qc_dir, pattern))
+                      if not os.path.basename(path).startswith(('.', '~$')) and QC_OUTPUT_SUFFIX not in os.path.basename(path)
+                      and os.path.abspath(path) != os.path.abspath(hybridoma_path))
+    if not qc_paths:
+        raise ValueError(f"No QC workbooks found in {qc_dir}")
+    os.makedirs(output_dir, exist_ok=True)
+
+    failed = []
+    for qc_path in qc_paths:
+        try:
+            updated_qc_data = annotate_qc_file(clone_map, qc_path)
+        except Exception as e:
+            print(f"Error annotating {qc_path}: {e}")
+            failed.append(qc_path)
+            continue
+        output_path = os.path.join(output_dir, os.path.splitext(os.path.basename(qc_path))[0] + QC_OUTPUT_SUFFIX + '.xlsx')
+        updated_qc_data.to_excel(output_path, index=False)
+        matched = updated_qc_data['Clone#'].notna().sum()
+        print(f"Updated file saved to {output_path} ({matched} of {len(updated_qc_data)} rows matched)")
+        if index_db:
+            indexed_count = upsert_clones(index_db, zip(updated_qc_data['DNAName'], updated_qc_data['Clone#']), os.path.abspath(output_path))
+            print(f"Indexed {indexed_count} clone numbers in {index_db}")
+    print(f"Annotated {len(qc_paths) - len(failed)} of {len(qc_paths)} QC files")
+    return failed
+
+# Command line: python pairing.py --registry HYBRIDOMA.xlsx --batch QC_DIR [--output OUTPUT_DIR]
+# Without --batch, the single-file dialogs are shown
+def main(index_db=TRIAGE_INDEX_DB):
+    parser = argparse.ArgumentParser(description='Append Clone# from the hybridoma registry to QC workbooks')
+    parser.add_argument('--registry', metavar='HYBRIDOMA_XLSX', help='Hybridoma registry workbook (asked for with a dialog if omitted)')
+    parser.add_argument('--batch', metavar='QC_DIR', help='Directory of QC workbooks to annotate in one run')
+    parser.add_argument('--output', metavar='OUTPUT_DIR', help='Output directory for batch mode (defaults to the QC directory)')
+    args = parser.parse_args()
+
+    if args.batch:
+        hybridoma_path = args.registry or load_file("Select the Hybridoma Excel File")
+        if not hybridoma_path:
+            return print("No hybridoma file selected, exiting the script.")
+        batch_annotate(hybridoma_path, args.batch, args.output or args.batch, index_db)
+        return
+
+    hybridoma_path = args.registry or load_file("Select the Hybridoma Excel File")
     qc_path = load_file("Select the QC Excel File")
     if not hybridoma_path or not qc_path:
         return print("Directory selection incomplete or incorrect file format, exiting the script.")
@@ -47,5 +155,10 @@ def main():
     updated_qc_data.to_excel(output_path, index=False)
     print(f"Updated file saved to {output_path}")
 
+    # Record the DNAName -> Clone# mapping in the SQLite triage index, keyed by the output file
+    if index_db:
+        indexed_count = upsert_clones(index_db, zip(updated_qc_data['DNAName'], updated_qc_data['Clone#']), os.path.abspath(output_path))
+        print(f"Indexed {indexed_count} clone numbers in {index_db}")
+
 if __name__ == "__main__":
     main()
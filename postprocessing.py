@@ -3,6 +3,12 @@ from tkinter import filedialog
 from tkinter import messagebox
 import os
 import re
+import glob
+import argparse
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from compressed_io import open_input, strip_compression_extension
 
 # Function to extract sequence names
 def parse_identifier(full_sequence_name):
@@ -14,120 +20,221 @@ def parse_identifier(full_sequence_name):
         return f"{prefix}-{number}", f"{prefix}-{chain_type}{number}", chain_type
     return None, None, None
 
+# Export the numbering of all paired chains as a dense residue matrix next to the _reordered output (see save_residue_matrix)
+EXPORT_RESIDUE_MATRIX = False
+
+# Numbering of all chains of one type (light or heavy) in a file, stored compactly: each chain keeps its position ids as
+# int32 bytes, shared by every chain with the same numbering, and its residues as one byte each
+class NumberingTable:
+    def __init__(self):
+        self.positions = {}  # (number, insertion code) -> position id, in first-seen order
+        self.patterns = {}  # Position id bytes -> the first equal bytes object, so chains with the same numbering share it
+
+    # Parse the numbered residue lines of one ANARCI block, e.g. 'H 111   A G' -> position (111, 'A'), residue G
+    # Returns (position ids, residue bytes) in file order, including '-' gaps
+    def parse(self, lines):
+        ids, residues = [], []
+        for line in lines:
+            fields = line.split()
+            if len(fields) not in (3, 4) or line.startswith('#') or not fields[1].isdigit():
+                continue
+            insertion = fields[2] if len(fields) == 4 else ''
+            ids.append(self.positions.setdefault((int(fields[1]), insertion), len(self.positions)))
+            residues.append(fields[-1][0])
+        pattern = np.array(ids, dtype=np.int32).tobytes()
+        return self.patterns.setdefault(pattern, pattern), ''.join(residues).encode('ascii', 'replace')
+
+    # Column order of the positions used by the given numbering patterns: by position number, and for insertion codes in the
+    # order ANARCI writes them (e.g. IMGT CDR3 111, 111A, 111B, ..., 112B, 112A, 112), merged across patterns in the given order
+    def ordered_positions(self, patterns):
+        keys = list(self.positions)
+        insertions = {}  # position number -> insertion codes in order
+        for pattern in patterns:
+            for number, group in _group_by_number(keys[i] for i in np.frombuffer(pattern, dtype=np.int32)):
+                known = insertions.setdefault(number, [])
+                for index, code in enumerate(group):
+                    if code in known:
+                        continue
+                    # Insert before the first code that follows it in this pattern and is already known
+                    following = [known.index(later) for later in group[index + 1:] if later in known]
+                    known.insert(following[0] if following else len(known), code)
+        return [(number, code) for number in sorted(insertions) for code in insertions[number]]
+
+def _group_by_number(positions):
+    groups = {}
+    for number, insertion in positions:
+        groups.setdefault(number, []).append(insertion)
+    return groups.items()
+
+# Dense residue matrix of paired chains: pairs x (light chain positions + heavy chain positions), uint8 ASCII residue codes
+# ('-' for numbered gaps, 0 for positions not numbered in that chain), with the pair ids and position labels (e.g. L27, H111A)
+# paired_numberings holds (pair id, light chain numbering, heavy chain numbering) as parsed by light_table and heavy_table
+def build_residue_matrix(paired_numberings, light_table, heavy_table):
+    ids = [pair_id for pair_id, _, _ in paired_numberings]
+    labels = []
+    chain_columns = []  # Per chain: (position id -> matrix column, pair element index, pattern -> matrix columns)
+    for chain_label, table, chain_index in (('L', light_table, 1), ('H', heavy_table, 2)):
+        patterns = dict.fromkeys(pair[chain_index][0] for pair in paired_numberings)  # Distinct patterns in output order
+        column_of = np.zeros(len(table.positions), dtype=np.int64)
+        for number, insertion in table.ordered_positions(patterns):
+            column_of[table.positions[(number, insertion)]] = len(labels)
+            labels.append(f"{chain_label}{number}{insertion}")
+        chain_columns.append((column_of, chain_index, {}))
+
+    matrix = np.zeros((len(ids), len(labels)), dtype=np.uint8)
+    for row, pair in enumerate(paired_numberings):
+        for column_of, chain_index, pattern_columns in chain_columns:
+            pattern, residues = pair[chain_index]
+            if pattern not in pattern_columns:
+                pattern_columns[pattern] = column_of[np.frombuffer(pattern, dtype=np.int32)]
+            matrix[row, pattern_columns[pattern]] = np.frombuffer(residues, dtype=np.uint8)
+    return matrix, np.array(ids, dtype=str), np.array(labels, dtype=str)
+
+# Save the residue matrix, pair ids and position labels as .npy files, memory-mappable with np.load(path, mmap_mode='r')
+# Returns the matrix path
+def save_residue_matrix(paired_numberings, light_table, heavy_table, output_directory, base_name):
+    matrix, ids, labels = build_residue_matrix(paired_numberings, light_table, heavy_table)
+    matrix_path = os.path.join(output_directory, base_name + '_residues.npy')
+    np.save(matrix_path, matrix)
+    np.save(os.path.join(output_directory, base_name + '_residue_ids.npy'), ids)
+    np.save(os.path.join(output_directory, base_name + '_residue_positions.npy'), labels)
+    return matrix_path
+
 # Reorder data structure
-def parse_and_reorder_blocks(file_path, output_directory):
-    try:
-        with open(file_path, 'r') as file:
-            content = file.read().strip()
-
-        if not content:
-            raise ValueError("The file is empty or not properly formatted.")
-
-        blocks = content.split('//')
-        heavy_chains = {}
-        light_chains = {}
-        unmatched_heavy = []
-        unmatched_light = []
-        missing_sequence_data = []
-        excluded_pairs = []
-        pair_count = 0  # Counter for matched pairs
-
-        # Identify and categorize each block
-        for block in blocks:
-            if not block.strip():
-                continue  # Skip empty blocks
-            lines = block.strip().split('\n')
-            header = lines[0]  # The header line with the sequence name and type
+# Writes the _reordered and _log files for one ANARCI output and returns a summary of the pairs and unmatched chains
+# Raises on unreadable or empty input; verbose=False suppresses the per-block and per-chain terminal output
+# residue_matrix=True also saves the numbering of the included pairs as a dense residue matrix (see save_residue_matrix)
+# output_name replaces the input file name (without .gz/.zst) as the base of the output file names
+def reorder_file(file_path, output_directory, verbose=True, residue_matrix=EXPORT_RESIDUE_MATRIX, output_name=None):
+    with open_input(file_path) as file:  # Plain, gzip- or zstd-compressed input
+        content = file.read().strip()
+
+    if not content:
+        raise ValueError("The file is empty or not properly formatted.")
 
+    blocks = content.split('//')
+    heavy_chains = {}
+    light_chains = {}
+    unmatched_heavy = []
+    unmatched_light = []
+    missing_sequence_data = []
+    excluded_pairs = []
+    pair_count = 0  # Counter for matched pairs
+    numbering_tables = {'a': NumberingTable(), 'b': NumberingTable()} if residue_matrix else None
+
+    # Identify and categorize each block
+    for block in blocks:
+        if not block.strip():
+            continue  # Skip empty blocks
+        lines = block.strip().split('\n')
+        header = lines[0]  # The header line with the sequence name and type
+
+        if verbose:
             print(f"Processing block with header: {header}")  # Debug print
 
-            # Check if there's sequence data
-            sequence_present = any(" " in line and line.split()[1].isalpha() for line in lines if line.strip())
+        # Check if there's sequence data
+        sequence_present = any(" " in line and line.split()[1].isalpha() for line in lines if line.strip())
+        if verbose:
             print(f"Sequence present: {sequence_present}")  # Debug print
 
-            # Extract IDs using the provided regular expression
-            main_id, full_id, chain_type = parse_identifier(header)
-            # print(f"Extracted IDs - Main ID: {main_id}, Full ID: {full_id}, Chain Type: {chain_type}")  # Debug print
-
-            if chain_type == 'b':
-                if sequence_present:
-                    heavy_chains[main_id] = {'block': block + '//', 'name': header}
-                else:
-                    missing_sequence_data.append((header, 'Header present but empty sequence for heavy chain (meaning ANARCI failed to annotate)'))
-            elif chain_type == 'a':
-                if sequence_present:
-                    light_chains[main_id] = {'block': block + '//', 'name': header}
-                else:
-                    missing_sequence_data.append((header, 'Header present but empty sequence for light chain (meaning ANARCI failed to annotate)'))
-
-        # Ensure that only complete, annotated pairs are included
-        reordered_content = ''
-        for light_id, light_data in light_chains.items():
-            if light_id in heavy_chains:
-                reordered_content += light_data['block'].strip() + '\n' + heavy_chains[light_id]['block'].strip() + '\n'
-                del heavy_chains[light_id]  # Remove matched heavy chain
-                pair_count += 1
+        # Extract IDs using the provided regular expression
+        main_id, full_id, chain_type = parse_identifier(header)
+        # print(f"Extracted IDs - Main ID: {main_id}, Full ID: {full_id}, Chain Type: {chain_type}")  # Debug print
+
+        if chain_type == 'b':
+            if sequence_present:
+                heavy_chains[main_id] = {'block': block + '//', 'name': header, 'numbering': numbering_tables[chain_type].parse(lines) if residue_matrix else None}
             else:
-                unmatched_light.append((light_data['name'], 'Missing annotated heavy chain'))
-                excluded_pairs.append((light_data['name'], 'Missing annotated heavy chain'))
-
-        for heavy_id, heavy_data in heavy_chains.items():
-            unmatched_heavy.append((heavy_data['name'], 'Missing annotated light chain'))
-            excluded_pairs.append((heavy_data['name'], 'Missing annotated light chain'))
-
-        # Create output filename based on input filename
-        base_filename = os.path.basename(file_path)
-        new_filename = os.path.splitext(base_filename)[0] + '_reordered' + os.path.splitext(base_filename)[1]
-        output_path = os.path.join(output_directory, new_filename)
-
-        # Write reordered content to a new file
-        with open(output_path, 'w') as output_file:
-            output_file.write(reordered_content)
-
-        # Log the output
-        log_filename = os.path.splitext(base_filename)[0] + '_log.txt'
-        log_path = os.path.join(output_directory, log_filename)
-        with open(log_path, 'w') as log_file:
-            if unmatched_light or unmatched_heavy or missing_sequence_data:
-                if unmatched_light:
-                    log_file.write("\nUnmatched Light Chains:\n")
-                    for name, reason in unmatched_light:
-                        log_file.write(f"{name} - {reason}\n")
-                if unmatched_heavy:
-                    log_file.write("\nUnmatched Heavy Chains:\n")
-                    for name, reason in unmatched_heavy:
-                        log_file.write(f"{name} - {reason}\n")
-                if missing_sequence_data:
-                    log_file.write("\nEntries with Missing Sequence Data:\n")
-                    for name, reason in missing_sequence_data:
-                        log_file.write(f"{name} - {reason}\n")
-                if excluded_pairs:
-                    log_file.write("\nExcluded Pairs:\n")
-                    for name, reason in excluded_pairs:
-                        log_file.write(f"{name} - {reason}\n")
-            log_file.write(f"\nTotal sequence pairs included in the output: {pair_count}\n")
-
-        # Output unmatched chains, excluded pairs, and missing sequence data to the terminal
-        if unmatched_light or unmatched_heavy or missing_sequence_data or excluded_pairs:
+                missing_sequence_data.append((header, 'Header present but empty sequence for heavy chain (meaning ANARCI failed to annotate)'))
+        elif chain_type == 'a':
+            if sequence_present:
+                light_chains[main_id] = {'block': block + '//', 'name': header, 'numbering': numbering_tables[chain_type].parse(lines) if residue_matrix else None}
+            else:
+                missing_sequence_data.append((header, 'Header present but empty sequence for light chain (meaning ANARCI failed to annotate)'))
+
+    # Ensure that only complete, annotated pairs are included
+    reordered_content = ''
+    paired_numberings = []  # (pair id, light chain numbering, heavy chain numbering) in output order
+    for light_id, light_data in light_chains.items():
+        if light_id in heavy_chains:
+            reordered_content += light_data['block'].strip() + '\n' + heavy_chains[light_id]['block'].strip() + '\n'
+            paired_numberings.append((light_id, light_data['numbering'], heavy_chains[light_id]['numbering']))
+            del heavy_chains[light_id]  # Remove matched heavy chain
+            pair_count += 1
+        else:
+            unmatched_light.append((light_data['name'], 'Missing annotated heavy chain'))
+            excluded_pairs.append((light_data['name'], 'Missing annotated heavy chain'))
+
+    for heavy_id, heavy_data in heavy_chains.items():
+        unmatched_heavy.append((heavy_data['name'], 'Missing annotated light chain'))
+        excluded_pairs.append((heavy_data['name'], 'Missing annotated light chain'))
+
+    # Create output filename based on input filename (without any .gz/.zst extension)
+    base_filename = output_name or os.path.basename(strip_compression_extension(file_path))
+    new_filename = os.path.splitext(base_filename)[0] + '_reordered' + os.path.splitext(base_filename)[1]
+    output_path = os.path.join(output_directory, new_filename)
+
+    # Write reordered content to a new file
+    with open(output_path, 'w') as output_file:
+        output_file.write(reordered_content)
+
+    # Save the paired chain numbering as a residue matrix
+    matrix_path = save_residue_matrix(paired_numberings, numbering_tables['a'], numbering_tables['b'], output_directory, os.path.splitext(base_filename)[0]) if residue_matrix else None
+
+    # Log the output
+    log_filename = os.path.splitext(base_filename)[0] + '_log.txt'
+    log_path = os.path.join(output_directory, log_filename)
+    with open(log_path, 'w') as log_file:
+        if unmatched_light or unmatched_heavy or missing_sequence_data:
             if unmatched_light:
-                print("\nUnmatched Light Chains:")
+                log_file.write("\nUnmatched Light Chains:\n")
                 for name, reason in unmatched_light:
-                    print(f"{name} - {reason}")
+                    log_file.write(f"{name} - {reason}\n")
             if unmatched_heavy:
-                print("\nUnmatched Heavy Chains:")
+                log_file.write("\nUnmatched Heavy Chains:\n")
                 for name, reason in unmatched_heavy:
-                    print(f"{name} - {reason}")
+                    log_file.write(f"{name} - {reason}\n")
             if missing_sequence_data:
-                print("\nEntries with Missing Sequence Data:")
+                log_file.write("\nEntries with Missing Sequence Data:\n")
                 for name, reason in missing_sequence_data:
-                    print(f"{name} - {reason}")
+                    log_file.write(f"{name} - {reason}\n")
             if excluded_pairs:
-                print("\nExcluded Pairs:")
+                log_file.write("\nExcluded Pairs:\n")
                 for name, reason in excluded_pairs:
-                    print(f"{name} - {reason}")
+                    log_file.write(f"{name} - {reason}\n")
+        log_file.write(f"\nTotal sequence pairs included in the output: {pair_count}\n")
+
+    # Output unmatched chains, excluded pairs, and missing sequence data to the terminal
+    if verbose and (unmatched_light or unmatched_heavy or missing_sequence_data or excluded_pairs):
+        if unmatched_light:
+            print("\nUnmatched Light Chains:")
+            for name, reason in unmatched_light:
+                print(f"{name} - {reason}")
+        if unmatched_heavy:
+            print("\nUnmatched Heavy Chains:")
+            for name, reason in unmatched_heavy:
+                print(f"{name} - {reason}")
+        if missing_sequence_data:
+            print("\nEntries with Missing Sequence Data:")
+            for name, reason in missing_sequence_data:
+                print(f"{name} - {reason}")
+        if excluded_pairs:
+            print("\nExcluded Pairs:")
+            for name, reason in excluded_pairs:
+                print(f"{name} - {reason}")
+    if verbose:
         print(f"\nTotal sequence pairs included in the output: {pair_count}")
+        if matrix_path:
+            print(f"Residue matrix saved to {matrix_path}")
+
+    return {'file': file_path, 'name': base_filename, 'pair_count': pair_count, 'unmatched_light': unmatched_light, 'unmatched_heavy': unmatched_heavy,
+            'missing_sequence_data': missing_sequence_data, 'excluded_pairs': excluded_pairs, 'residue_matrix': matrix_path}
 
-        messagebox.showinfo("Success", f"File reordered successfully. {pair_count} pairs included. Check the terminal and log file for issues.")
+# Reorder a single file selected through the dialogs, reporting the result in a message box
+def parse_and_reorder_blocks(file_path, output_directory):
+    try:
+        summary = reorder_file(file_path, output_directory)
+        messagebox.showinfo("Success", f"File reordered successfully. {summary['pair_count']} pairs included. Check the terminal and log file for issues.")
     except Exception as e:
         messagebox.showerror("Error", str(e))
 
@@ -144,5 +251,113 @@ def open_file_dialog():
     else:
         messagebox.showwarning("Warning", "File not selected.")
 
-# Trigger the file selection dialog
-open_file_dialog()
+BATCH_SUMMARY_FILENAME = 'batch_reorder_summary.txt'
+
+# Expand a directory, glob pattern or single file into the list of ANARCI outputs to reorder
+# Outputs of earlier runs (_reordered files, _log.txt files, .npy residue matrices and the batch summary) are skipped
+def collect_batch_inputs(input_path):
+    if os.path.isdir(input_path):
+        candidates = glob.glob(os.path.join(input_path, '*'))
+    else:
+        candidates = glob.glob(input_path)
+    inputs = []
+    for file_path in sorted(candidates):
+        name = os.path.basename(file_path)
+        if not os.path.isfile(file_path) or name.startswith('.') or name == BATCH_SUMMARY_FILENAME:
+            continue
+        if '_reordered' in name or strip_compression_extension(name).endswith(('_log.txt', '.npy')):
+            continue
+        inputs.append(file_path)
+    return inputs
+
+# Output name of each batch input: its path relative to the common input directory, without any .gz/.zst extension,
+# with directory separators replaced by '__' (e.g. campaign/plate1/anarci.txt -> plate1__anarci.txt)
+# Raises when two inputs would still write the same outputs (e.g. run1.txt next to run1.txt.gz)
+def batch_output_names(inputs):
+    root = os.path.commonpath([os.path.dirname(os.path.abspath(file_path)) for file_path in inputs])
+    names = [os.path.relpath(strip_compression_extension(os.path.abspath(file_path)), root).replace(os.sep, '__') for file_path in inputs]
+    duplicates = sorted(name for name, count in Counter(names).items() if count > 1)
+    if duplicates:
+        clashing = [file_path for file_path, name in zip(inputs, names) if name in duplicates]
+        raise ValueError(f"Batch inputs would overwrite each other's outputs ({', '.join(duplicates)}): {', '.join(clashing)}")
+    return names
+
+# Default batch output directory: the input directory, or for a glob its deepest parent directory without wildcards
+def default_batch_output(input_path):
+    if os.path.isdir(input_path):
+        return input_path
+    parts = []
+    for part in os.path.dirname(input_path).split(os.sep):
+        if glob.has_magic(part):
+            break
+        parts.append(part)
+    return os.sep.join(parts) or ('/' if input_path.startswith(os.sep) else '.')
+
+# Worker process entry point, errors are returned instead of raised so one bad file does not stop the batch
+def _reorder_worker(file_path, output_directory, residue_matrix=EXPORT_RESIDUE_MATRIX, output_name=None):
+    try:
+        return reorder_file(file_path, output_directory, verbose=False, residue_matrix=residue_matrix, output_name=output_name)
+    except Exception as e:
+        return {'file': file_path, 'name': output_name or os.path.basename(file_path), 'error': str(e)}
+
+# Reorder every ANARCI output in a directory or glob in parallel worker processes
+# Each input gets its own _reordered and _log files (named by batch_output_names); the aggregate pair/unmatched summary is written to batch_reorder_summary.txt
+def batch_reorder(input_path, output_directory, workers=None, residue_matrix=EXPORT_RESIDUE_MATRIX):
+    inputs = collect_batch_inputs(input_path)
+    if not inputs:
+        raise ValueError(f"No ANARCI files found for {input_path}")
+    output_names = batch_output_names(inputs)
+    os.makedirs(output_directory, exist_ok=True)
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        summaries = list(executor.map(_reorder_worker, inputs, [output_directory] * len(inputs), [residue_matrix] * len(inputs), output_names))
+
+    total_pairs = sum(summary.get('pair_count', 0) for summary in summaries)
+    total_unmatched = sum(len(summary.get('unmatched_light', [])) + len(summary.get('unmatched_heavy', [])) for summary in summaries)
+    failed = [summary for summary in summaries if 'error' in summary]
+
+    summary_path = os.path.join(output_directory, BATCH_SUMMARY_FILENAME)
+    with open(summary_path, 'w') as summary_file:
+        summary_file.write("File\tPairs\tUnmatched Light\tUnmatched Heavy\tMissing Sequence Data\tStatus\n")
+        for summary in summaries:
+            if 'error' in summary:
+                summary_file.write(f"{summary['name']}\t0\t0\t0\t0\tError: {summary['error']}\n")
+            else:
+                summary_file.write(f"{summary['name']}\t{summary['pair_count']}\t{len(summary['unmatched_light'])}\t"
+                                   f"{len(summary['unmatched_heavy'])}\t{len(summary['missing_sequence_data'])}\tOK\n")
+        for summary in summaries:
+            unmatched = summary.get('unmatched_light', []) + summary.get('unmatched_heavy', [])
+            if unmatched:
+                summary_file.write(f"\nUnmatched Chains in {summary['name']}:\n")
+                for name, reason in unmatched:
+                    summary_file.write(f"{name} - {reason}\n")
+        summary_file.write(f"\nTotal files: {len(summaries)} ({len(failed)} failed)\n")
+        summary_file.write(f"Total sequence pairs included in the outputs: {total_pairs}\n")
+        summary_file.write(f"Total unmatched chains: {total_unmatched}\n")
+
+    for summary in failed:
+        print(f"Error reordering {summary['file']}: {summary['error']}")
+    print(f"Reordered {len(summaries) - len(failed)} of {len(summaries)} files, {total_pairs} pairs included, {total_unmatched} unmatched chains")
+    print(f"Batch summary saved to {summary_path}")
+    return summaries
+
+# Command line: python postprocessing.py --batch DIR_OR_GLOB --output OUTPUT_DIR [--workers N] [--residue-matrix]
+# Without --batch, the single-file dialogs are shown
+def main():
+    parser = argparse.ArgumentParser(description='Reorder ANARCI outputs into light/heavy pairs')
+    parser.add_argument('--batch', metavar='DIR_OR_GLOB', help='Directory or glob of ANARCI outputs to reorder in parallel')
+    parser.add_argument('--output', metavar='OUTPUT_DIR', help='Output directory for batch mode (defaults to the input directory, or the deepest parent without wildcards of a glob)')
+    parser.add_argument('--workers', type=int, default=None, help='Number of worker processes (defaults to all cores)')
+    parser.add_argument('--residue-matrix', action='store_true', default=EXPORT_RESIDUE_MATRIX, help='Also save each file\'s paired chain numbering as a .npy residue matrix')
+    args = parser.parse_args()
+
+    if args.batch:
+        output_directory = args.output or default_batch_output(args.batch)
+        batch_reorder(args.batch, output_directory, args.workers, args.residue_matrix)
+    else:
+        # Trigger the file selection dialog
+        open_file_dialog()
+
+if __name__ == "__main__":
+    main()
+
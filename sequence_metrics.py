@@ -0,0 +1,120 @@
+import numpy as np
+
+# Column names added to the annotated QC output, in order
+METRIC_COLUMNS = ['Seq Length', 'Ambiguous Fraction', 'GC Content', 'Max Homopolymer', 'Frame Stop Codon']
+
+# Stop codons for the translated frame (frame 1, starting at the first base of each record)
+STOP_CODONS = (b'TAA', b'TAG', b'TGA')
+
+# Lookup table to uppercase an ASCII uint8 buffer in one vectorized pass
+_UPPERCASE = np.arange(256, dtype=np.uint8)
+_UPPERCASE[ord('a'):ord('z') + 1] -= 32
+
+# Records are processed in chunks of roughly this many bases to keep the intermediate arrays bounded
+CHUNK_BASES = 1 << 24
+
+
+# Pack sequences (str or bytes) into one contiguous uppercased uint8 buffer plus record boundary offsets
+# offsets has one more entry than there are sequences, so record i spans buffer[offsets[i]:offsets[i + 1]]
+def pack_sequences(sequences):
+    encoded = [seq.encode() if isinstance(seq, str) else bytes(seq) for seq in sequences]
+    lengths = np.fromiter((len(seq) for seq in encoded), dtype=np.int64, count=len(encoded))
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=offsets[1:])
+    buffer = _UPPERCASE[np.frombuffer(b''.join(encoded), dtype=np.uint8)]
+    return buffer, offsets
+
+# Sum a per-base boolean/int array over each record using a cumulative sum (empty records sum to 0)
+def _segment_sum(values, offsets):
+    cumulative = np.zeros(len(values) + 1, dtype=np.int64)
+    np.cumsum(values, out=cumulative[1:])
+    return cumulative[offsets[1:]] - cumulative[offsets[:-1]]
+
+# Compute all metrics for one packed buffer
+def _packed_metrics(buffer, offsets):
+    n_records = len(offsets) - 1
+    lengths = np.diff(offsets)
+    record_of_base = np.repeat(np.arange(n_records), lengths)
+
+    # Ambiguous bases are anything other than A/C/G/T (N, IUPAC codes, gaps)
+    is_gc = (buffer == ord('G')) | (buffer == ord('C'))
+    is_acgt = is_gc | (buffer == ord('A')) | (buffer == ord('T'))
+    acgt_counts = _segment_sum(is_acgt, offsets)
+    gc_counts = _segment_sum(is_gc, offsets)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ambiguous_fraction = np.where(lengths > 0, (lengths - acgt_counts) / lengths, 0.0)
+        gc_content = np.where(acgt_counts > 0, gc_counts / acgt_counts, 0.0)
+
+    # Homopolymer runs: a run starts at every record start and wherever the base changes
+    max_homopolymer = np.zeros(n_records, dtype=np.int64)
+    if len(buffer):
+        run_starts = np.ones(len(buffer), dtype=bool)
+        run_starts[1:] = buffer[1:] != buffer[:-1]
+        run_starts[offsets[:-1][lengths > 0]] = True
+        run_start_index = np.flatnonzero(run_starts)
+        run_lengths = np.diff(np.append(run_start_index, len(buffer)))
+        np.maximum.at(max_homopolymer, record_of_base[run_start_index], run_lengths)
+
+    # Stop codons: codons starting at in-frame positions that fit completely inside their record
+    has_stop = np.zeros(n_records, dtype=bool)
+    if len(buffer) >= 3:
+        codons = (buffer[:-2].astype(np.uint32) << 16) | (buffer[1:-1].astype(np.uint32) << 8) | buffer[2:]
+        stop_codes = [(c[0] << 16) | (c[1] << 8) | c[2] for c in STOP_CODONS]
+        position_in_record = np.arange(len(buffer) - 2) - offsets[record_of_base[:-2]]
+        in_frame = (position_in_record % 3 == 0) & (position_in_record + 3 <= lengths[record_of_base[:-2]])
+        is_stop = np.zeros(len(buffer), dtype=bool)
+        is_stop[:-2] = in_frame & np.isin(codons, stop_codes)
+        has_stop = _segment_sum(is_stop, offsets) > 0
+
+    return {
+        'Seq Length': lengths,
+        'Ambiguous Fraction': ambiguous_fraction,
+        'GC Content': gc_content,
+        'Max Homopolymer': max_homopolymer,
+        'Frame Stop Codon': has_stop,
+    }
+
+# Compute per-record length, ambiguous-base fraction, GC content, longest homopolymer run and
+# in-frame stop codon presence for a list of sequences, returning one NumPy array per METRIC_COLUMNS entry
+def compute_sequence_metrics(sequences, chunk_bases=CHUNK_BASES):
+    chunks = {column: [] for column in METRIC_COLUMNS}
+    start = 0
+    while start < len(sequences):
+        end, chunk_size = start, 0
+        while end < len(sequences) and (chunk_size < chunk_bases or end == start):
+            chunk_size += len(sequences[end])
+            end += 1
+        buffer, offsets = pack_sequences(sequences[start:end])
+        for column, values in _packed_metrics(buffer, offsets).items():
+            chunks[column].append(values)
+        start = end
+    empty = {'Seq Length': np.int64, 'Ambiguous Fraction': np.float64, 'GC Content': np.float64, 'Max Homopolymer': np.int64, 'Frame Stop Codon': bool}
+    return {column: np.concatenate(chunks[column]) if chunks[column] else np.zeros(0, dtype=empty[column]) for column in METRIC_COLUMNS}
+
+# Evaluate the optional metric triage criteria, returning a boolean array marking records that fail any of them
+# Criteria left as None (or reject_stop_codons=False) are ignored
+def failing_metric_criteria(metrics, criteria):
+    failing = np.zeros(len(metrics['Seq Length']), dtype=bool)
+    if criteria.get('min_length') is not None:
+        failing |= metrics['Seq Length'] < criteria['min_length']
+    if criteria.get('max_ambiguous_fraction') is not None:
+        failing |= metrics['Ambiguous Fraction'] > criteria['max_ambiguous_fraction']
+    if criteria.get('min_gc_content') is not None:
+        failing |= metrics['GC Content'] < criteria['min_gc_content']
+    if criteria.get('max_gc_content') is not None:
+        failing |= metrics['GC Content'] > criteria['max_gc_content']
+    if criteria.get('max_homopolymer') is not None:
+        failing |= metrics['Max Homopolymer'] > criteria['max_homopolymer']
+    if criteria.get('reject_stop_codons'):
+        failing |= metrics['Frame Stop Codon']
+    return failing
+
+# Convert the metrics of one record into plain Python values for writing to Excel
+def metric_row(metrics, index):
+    return [
+        int(metrics['Seq Length'][index]),
+        round(float(metrics['Ambiguous Fraction'][index]), 4),
+        round(float(metrics['GC Content'][index]), 4),
+        int(metrics['Max Homopolymer'][index]),
+        bool(metrics['Frame Stop Codon'][index]),
+    ]
@@ -0,0 +1,143 @@
+import argparse
+import datetime
+import math
+import re
+import sqlite3
+
+# Persistent SQLite index of triaged pairs (workflow.py) and clone numbers (pairing.py) across runs
+# Each row records the run (output directory or output file) that produced it, and re-running the same run updates its rows in place
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS pairs (
+    base_id TEXT NOT NULL,
+    source_run TEXT NOT NULL,
+    prefix TEXT,
+    heavy_category INTEGER,
+    light_category INTEGER,
+    pair_category INTEGER,
+    indexed_at TEXT,
+    PRIMARY KEY (base_id, source_run)
+);
+CREATE INDEX IF NOT EXISTS pairs_prefix_category ON pairs (prefix, pair_category);
+CREATE TABLE IF NOT EXISTS clones (
+    sequence_id TEXT NOT NULL,
+    source_run TEXT NOT NULL,
+    base_id TEXT,
+    clone_number TEXT,
+    indexed_at TEXT,
+    PRIMARY KEY (sequence_id, source_run)
+);
+CREATE INDEX IF NOT EXISTS clones_clone_number ON clones (clone_number);
+CREATE INDEX IF NOT EXISTS clones_base_id ON clones (base_id);
+"""
+
+# Same id convention as workflow.py: B1-b12 / B1-a12 -> base_id B1-12
+def base_id_for(sequence_name):
+    match = re.match(r'^>?([\w-]+?)-?(b|a)(\d+)', str(sequence_name))
+    if match:
+        return f"{match.group(1)}-{match.group(3)}"
+    return None
+
+# Clone numbers come from Excel as ints, floats (e.g. 12.0), strings or NaN
+def normalize_clone_number(clone_number):
+    if clone_number is None or (isinstance(clone_number, float) and math.isnan(clone_number)):
+        return None
+    if isinstance(clone_number, float) and clone_number.is_integer():
+        return str(int(clone_number))
+    return str(clone_number).strip()
+
+def open_index(db_path):
+    connection = sqlite3.connect(db_path)
+    connection.executescript(SCHEMA)
+    return connection
+
+def timestamp():
+    return datetime.datetime.now().isoformat(timespec='seconds')
+
+# Upsert every pair of a PairStore (see pair_store.py) for one triage run
+def upsert_pairs(db_path, pair_store, source_run):
+    indexed_at = timestamp()
+    rows = ((base_id, source_run, base_id.split('-')[0], heavy, light, max(heavy, light), indexed_at)
+            for base_id, heavy, light in pair_store.items())
+    with open_index(db_path) as connection:
+        connection.executemany("""
+            INSERT INTO pairs (base_id, source_run, prefix, heavy_category, light_category, pair_category, indexed_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT (base_id, source_run) DO UPDATE SET
+                prefix = excluded.prefix, heavy_category = excluded.heavy_category, light_category = excluded.light_category,
+                pair_category = excluded.pair_category, indexed_at = excluded.indexed_at
+        """, rows)
+    connection.close()
+    return len(pair_store)
+
+# Upsert (sequence_id, clone_number) mappings from one clone annotation run
+def upsert_clones(db_path, clone_rows, source_run):
+    indexed_at = timestamp()
+    rows = [(str(sequence_id).strip(), source_run, base_id_for(sequence_id), normalize_clone_number(clone_number), indexed_at)
+            for sequence_id, clone_number in clone_rows if sequence_id is not None and not (isinstance(sequence_id, float) and math.isnan(sequence_id))]
+    with open_index(db_path) as connection:
+        connection.executemany("""
+            INSERT INTO clones (sequence_id, source_run, base_id, clone_number, indexed_at)
+            VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT (sequence_id, source_run) DO UPDATE SET
+                base_id = excluded.base_id, clone_number = excluded.clone_number, indexed_at = excluded.indexed_at
+        """, rows)
+    connection.close()
+    return len(rows)
+
+# Look up a base_id (B1-12), chain/sequence id (B1-b12) or clone number
+# Returns (pair rows, clone rows); pairs include those of every base_id the clone number maps to
+def lookup(db_path, term):
+    connection = open_index(db_path)
+    connection.row_factory = sqlite3.Row
+    clone_rows = connection.execute(
+        "SELECT * FROM clones WHERE clone_number = ? OR sequence_id = ? OR base_id = ? ORDER BY sequence_id, source_run",
+        (term, term, base_id_for(term) or term)).fetchall()
+    base_ids = {base_id_for(term) or term} | {row['base_id'] for row in clone_rows if row['base_id']}
+    placeholders = ','.join('?' * len(base_ids))
+    pair_rows = connection.execute(
+        f"SELECT * FROM pairs WHERE base_id IN ({placeholders}) ORDER BY base_id, indexed_at", sorted(base_ids)).fetchall()
+    connection.close()
+    return pair_rows, clone_rows
+
+# List the pairs of one box, optionally restricted to a pair category
+def list_prefix(db_path, prefix, pair_category=None):
+    connection = open_index(db_path)
+    connection.row_factory = sqlite3.Row
+    if pair_category is None:
+        rows = connection.execute("SELECT * FROM pairs WHERE prefix = ? ORDER BY base_id, source_run", (prefix,)).fetchall()
+    else:
+        rows = connection.execute("SELECT * FROM pairs WHERE prefix = ? AND pair_category = ? ORDER BY base_id, source_run", (prefix, pair_category)).fetchall()
+    connection.close()
+    return rows
+
+def print_pair_row(row):
+    print(f"Pair {row['base_id']} (Heavy Chain: Category {row['heavy_category']}, Light Chain: Category {row['light_category']}) - "
+          f"Pair Category: {row['pair_category']} - Run: {row['source_run']} ({row['indexed_at']})")
+
+# Command line: python triage_index.py INDEX_DB TERM [TERM ...]   (base_id, sequence id or clone number)
+#               python triage_index.py INDEX_DB --prefix B1 [--category 1]
+def main():
+    parser = argparse.ArgumentParser(description='Look up triaged pairs and clone numbers in the SQLite triage index')
+    parser.add_argument('index_db', help='Path to the SQLite index database')
+    parser.add_argument('terms', nargs='*', help='base_id (B1-12), sequence id (B1-b12) or clone number')
+    parser.add_argument('--prefix', help='List all pairs of a box prefix')
+    parser.add_argument('--category', type=int, help='With --prefix, only list pairs of this pair category')
+    args = parser.parse_args()
+
+    if args.prefix:
+        rows = list_prefix(args.index_db, args.prefix, args.category)
+        for row in rows:
+            print_pair_row(row)
+        print(f"{len(rows)} pairs")
+    for term in args.terms:
+        pair_rows, clone_rows = lookup(args.index_db, term)
+        print(f"{term}:")
+        for row in clone_rows:
+            print(f"Sequence {row['sequence_id']} - Clone# {row['clone_number']} - Run: {row['source_run']} ({row['indexed_at']})")
+        for row in pair_rows:
+            print_pair_row(row)
+        if not pair_rows and not clone_rows:
+            print("No matches")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,175 @@
+import argparse
+import datetime
+import json
+import os
+import signal
+import tempfile
+import time
+import tkinter as tk
+from tkinter import filedialog
+import pandas as pd
+from compressed_io import open_input, COMPRESSED_EXTENSIONS
+from workflow import run_triage, parse_prefix, load_qc_workbook, SEQUENCE_METRICS, METRIC_CRITERIA, TRIAGE_INDEX_DB, OUT_OF_CORE, CLONOTYPE_CLUSTERING, PARTITIONED_OUTPUT
+
+POLL_INTERVAL = 10  # Seconds between directory scans
+DEBOUNCE_SECONDS = 120  # Quiet period after the last new/changed file before a batch is triaged
+STATUS_FILE_NAME = 'watch_status.json'  # Written to the output directory
+FASTA_EXTENSIONS = tuple(extension + compression for extension in ('.fasta', '.txt') for compression in ('',) + COMPRESSED_EXTENSIONS)  # Same file types that workflow.py reads
+
+# Take a snapshot of a directory as {path: (modification time, size)}, skipping hidden files and Excel lock files
+def snapshot_directory(directory, extensions=None):
+    snapshot = {}
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            if not entry.is_file() or entry.name.startswith(('.', '~$')):
+                continue
+            if extensions and not entry.name.endswith(extensions):
+                continue
+            stat = entry.stat()
+            snapshot[entry.path] = (stat.st_mtime_ns, stat.st_size)
+    return snapshot
+
+# Return the paths that are new or modified in the current snapshot compared to the previous one
+# .xlsx files that replace an .xls (see convert_xls_to_xlsx in workflow.py) are not counted as new data
+def changed_files(previous, current):
+    changed = set()
+    for path, signature in current.items():
+        if previous.get(path) == signature:
+            continue
+        if path.endswith('.xlsx') and path[:-1] in previous and path not in previous:
+            continue
+        changed.add(path)
+    return changed
+
+# Collect the box prefixes (e.g. B1) named in the TemplateName column of a QC workbook
+def boxes_in_qc_file(file_path):
+    if file_path.endswith('.xls'):
+        return {parse_prefix(name) for name in pd.read_excel(file_path)['TemplateName'] if isinstance(name, str)} - {None}
+    wb = load_qc_workbook(file_path, read_only=True)
+    rows = wb.active.iter_rows(values_only=True)
+    header = list(next(rows, []))
+    if 'TemplateName' not in header:
+        wb.close()
+        return set()
+    template_index = header.index('TemplateName')
+    boxes = {parse_prefix(row[template_index]) for row in rows if row and isinstance(row[template_index], str)}
+    wb.close()
+    return boxes - {None}
+
+# Collect the box prefixes named in the headers of a FASTA file
+def boxes_in_fasta_file(file_path):
+    boxes = set()
+    with open_input(file_path) as file:
+        for line in file:
+            if line.startswith('>'):
+                header = line[1:].split()
+                boxes.add(parse_prefix(header[0] if header else None))
+    return boxes - {None}
+
+# Write the status dictionary atomically so readers never see a half-written file
+def write_status(status_path, status):
+    temp_path = status_path + '.tmp'
+    with open(temp_path, 'w') as status_file:
+        json.dump(status, status_file, indent=2)
+    os.replace(temp_path, status_path)
+
+def timestamp():
+    return datetime.datetime.now().isoformat(timespec='seconds')
+
+# Watch the QC and FASTA directories and triage every debounced batch of new files, restricted to the boxes it touches
+# Each batch is written to its own run_<timestamp>_<suffix> folder inside output_dir, with progress in watch_status.json
+def watch(QC_file_dir, fasta_file_dir, output_dir, poll_interval=POLL_INTERVAL, debounce_seconds=DEBOUNCE_SECONDS, initial_run=False):
+    status_path = os.path.join(output_dir, STATUS_FILE_NAME)
+    status = {'state': 'watching', 'started': timestamp(), 'QC_file_dir': QC_file_dir, 'fasta_file_dir': fasta_file_dir,
+              'pending_files': [], 'runs_completed': 0, 'last_run': None, 'last_error': None}
+
+    known = {**snapshot_directory(QC_file_dir), **snapshot_directory(fasta_file_dir, FASTA_EXTENSIONS)}
+    pending = set(known) if initial_run else set()  # Files received since the last triage run
+    last_change = time.monotonic()
+    write_status(status_path, status)
+    print(f"Watching {QC_file_dir} and {fasta_file_dir} (debounce {debounce_seconds}s), status in {status_path}")
+
+    try:
+        while True:
+            current = {**snapshot_directory(QC_file_dir), **snapshot_directory(fasta_file_dir, FASTA_EXTENSIONS)}
+            new_files = changed_files(known, current)
+            known = current
+            if new_files:
+                pending |= new_files
+                last_change = time.monotonic()
+                status['pending_files'] = sorted(pending)
+                write_status(status_path, status)
+                print(f"{len(new_files)} new or changed file(s), {len(pending)} pending")
+
+            # Triage once the burst of new files has settled
+            if pending and time.monotonic() - last_change >= debounce_seconds:
+                batch = sorted(path for path in pending if path in current)
+                pending = set()
+                boxes = set()
+                for file_path in batch:
+                    try:
+                        if file_path.startswith(os.path.join(fasta_file_dir, '')):
+                            boxes |= boxes_in_fasta_file(file_path)
+                        else:
+                            boxes |= boxes_in_qc_file(file_path)
+                    except Exception as e:
+                        print(f"Could not read {file_path}: {e}")
+                        status['last_error'] = f"{timestamp()} {file_path}: {e}"
+
+                if boxes:
+                    # Unique suffix so batches finishing within the same second never share a run folder
+                    run_dir = tempfile.mkdtemp(prefix='run_' + datetime.datetime.now().strftime('%Y%m%d_%H%M%S') + '_', dir=output_dir)
+                    status.update(state='running', pending_files=[])
+                    write_status(status_path, status)
+                    print(f"Triaging boxes {', '.join(sorted(boxes))} into {run_dir}")
+                    started, start_time = timestamp(), time.monotonic()
+                    try:
+                        category_counts = run_triage(QC_file_dir, fasta_file_dir, run_dir, sequence_metrics=SEQUENCE_METRICS, metric_criteria=METRIC_CRITERIA, prefixes=boxes, index_db=TRIAGE_INDEX_DB, out_of_core=OUT_OF_CORE, clonotype_clustering=CLONOTYPE_CLUSTERING, partitioned_output=PARTITIONED_OUTPUT)
+                        status['runs_completed'] += 1
+                        status['last_run'] = {'started': started, 'finished': timestamp(), 'seconds': round(time.monotonic() - start_time, 2),
+                                              'boxes': sorted(boxes), 'files': batch, 'output_dir': run_dir,
+                                              'category_counts': category_counts}
+                    except Exception as e:
+                        print(f"Triage run failed: {e}")
+                        status['last_error'] = f"{timestamp()} triage of {', '.join(sorted(boxes))}: {e}"
+                status.update(state='watching', pending_files=[])
+                write_status(status_path, status)
+
+            time.sleep(poll_interval)
+    finally:
+        status.update(state='stopped', stopped=timestamp())
+        write_status(status_path, status)
+
+# Command line: python watch_triage.py QC_DIR FASTA_DIR OUTPUT_DIR [--interval S] [--debounce S] [--initial-run]
+# Directories that are not given on the command line are asked for with file dialog boxes
+def main():
+    parser = argparse.ArgumentParser(description='Watch QC and FASTA directories and triage new plates as they land')
+    parser.add_argument('QC_file_dir', nargs='?', help='Directory containing Excel QC files')
+    parser.add_argument('fasta_file_dir', nargs='?', help='Directory containing FASTA sequence files')
+    parser.add_argument('output_dir', nargs='?', help='Directory for run folders and the status file')
+    parser.add_argument('--interval', type=float, default=POLL_INTERVAL, help='Seconds between directory scans')
+    parser.add_argument('--debounce', type=float, default=DEBOUNCE_SECONDS, help='Quiet seconds before a batch is triaged')
+    parser.add_argument('--initial-run', action='store_true', help='Triage the files already present at startup')
+    args = parser.parse_args()
+
+    if not args.QC_file_dir or not args.fasta_file_dir or not args.output_dir:
+        root = tk.Tk()
+        root.withdraw()
+        args.QC_file_dir = args.QC_file_dir or filedialog.askdirectory(title='Select directory containing Excel QC files')
+        args.fasta_file_dir = args.fasta_file_dir or filedialog.askdirectory(title='Select directory containing FASTA sequence files')
+        args.output_dir = args.output_dir or filedialog.askdirectory(title='Select Output Directory')
+        if not args.QC_file_dir or not args.fasta_file_dir or not args.output_dir:
+            return print("Directory selection incomplete, exiting the script.")
+
+    # Stop cleanly (status file set to 'stopped') on kill/timeout/systemd SIGTERM, like on Ctrl-C
+    def stop(signum, frame):
+        raise KeyboardInterrupt
+    signal.signal(signal.SIGTERM, stop)
+
+    try:
+        watch(args.QC_file_dir, args.fasta_file_dir, args.output_dir, args.interval, args.debounce, args.initial_run)
+    except KeyboardInterrupt:
+        print("Stopped watching.")
+
+if __name__ == "__main__":
+    main()
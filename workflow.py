@@ -1,13 +1,51 @@
 import openpyxl
 import tkinter as tk
 from tkinter import filedialog
-from Bio import SeqIO
 import re
 import os
 import glob
+import hashlib
+import itertools
+import heapq
+import pickle
+import shutil
+import tempfile
+from collections import OrderedDict
 import pandas as pd
 import matplotlib.pyplot as plt # type: ignore 
 import numpy as np  
+from compressed_io import open_input, read_input_bytes, compression_type, compressed_patterns, strip_compression_extension
+from pair_store import PairStore, MAX_CATEGORY, HEAVY_FASTA, LIGHT_FASTA
+from sequence_metrics import METRIC_COLUMNS, compute_sequence_metrics, failing_metric_criteria, metric_row
+from triage_index import upsert_pairs
+from fast_fasta import read_fasta_with_titles, write_fasta, write_fasta_record
+from clonotype_clusters import cluster_category_files, CLUSTER_CATEGORIES
+from fasta_shards import FastaShardWriter, SHARD_DIR_NAME
+
+# Optional sequence composition metrics stage (see sequence_metrics.py)
+# When enabled, per-chain metrics are added as columns to COMBINED_QC_DATA_WITH_CATEGORIES.xlsx
+SEQUENCE_METRICS = False
+# Extra triage criteria applied on top of CRL/QualitySCore when SEQUENCE_METRICS is enabled (None disables a criterion)
+# Chains failing any criterion are assigned Category 7
+METRIC_CRITERIA = {
+    'min_length': None,
+    'max_ambiguous_fraction': None,
+    'min_gc_content': None,
+    'max_gc_content': None,
+    'max_homopolymer': None,
+    'reject_stop_codons': False,
+}
+# Optional SQLite index (see triage_index.py) that every run upserts its pair categories into, e.g. 'triage_index.sqlite'
+TRIAGE_INDEX_DB = None
+# Out-of-core mode for runs larger than RAM: QC rows and FASTA records are spilled into per-prefix (box) partition files
+# and triaged one box at a time, so peak memory is bounded by the largest box. Outputs match the in-memory path
+OUT_OF_CORE = False
+MAX_OPEN_SPILL_FILES = 64  # Partition spill files kept open at once, least recently written ones are closed and reopened for appending
+MERGE_FAN_IN = 32  # Spill files merged at once, more partitions are first merged in passes of MERGE_FAN_IN files
+# Cluster the paired sequences of CLUSTER_CATEGORIES into near-duplicate clonotypes after triage (see clonotype_clusters.py)
+CLONOTYPE_CLUSTERING = False
+# Also write one FASTA shard per (category, prefix) with a manifest of record counts, sizes and checksums (see fasta_shards.py)
+PARTITIONED_OUTPUT = False
 
 # Extract sequence names from FASTA and Excel files
 def parse_identifier(full_sequence_name):
@@ -19,6 +57,11 @@ def parse_identifier(full_sequence_name):
         return f"{prefix}-{number}", f"{prefix}-{number}{chain_type}", chain_type
     return None, None, None
 
+# Extract the box prefix (e.g. B1) from a sequence or TemplateName id, or None if the id does not parse
+def parse_prefix(full_sequence_name):
+    base_id, _, _ = parse_identifier(full_sequence_name or '')
+    return base_id.split('-')[0] if base_id else None
+
 # Function for category aasignment
 def determine_category(crl, qs):
     # Ensure that CRL and QualityScore are not None and are integers
@@ -47,6 +90,60 @@ def determine_category(crl, qs):
             return 6
     return 7  # Default to Category 7 if above criteria are not met
 
+# Hash an (id, sequence) pair into a compact 8-byte digest used to drop exact duplicate FASTA records
+def record_digest(seq_id, seq):
+    return hashlib.blake2b(seq_id.encode() + b'\n' + seq, digest_size=8).digest()
+
+# Check one FASTA record against the records kept so far and return its status with the matching log line:
+# 'duplicate' for an exact (id, sequence) repeat that is dropped, 'conflict' for a new sequence under an already kept id
+# (kept but reported), or 'kept' (log line None)
+# seen_digests holds the digests of every kept record; seen_ids maps each kept id to the digest of its first sequence
+def deduplicate_record(seq_id, seq, source_name, seen_digests, seen_ids, dedup_stats):
+    digest = record_digest(seq_id, seq)
+    if digest in seen_digests:
+        dedup_stats['duplicates'] += 1
+        return 'duplicate', f"Duplicate FASTA record dropped: {seq_id} ({source_name})"
+    seen_digests.add(digest)
+    if seq_id in seen_ids:
+        dedup_stats['conflicts'] += 1
+        print(f"{seq_id} has conflicting sequences across FASTA records!")
+        return 'conflict', f"Conflicting FASTA record: {seq_id} ({source_name}) differs from an earlier sequence with the same id"
+    seen_ids[seq_id] = digest
+    return 'kept', None
+
+# Read (id, title, sequence bytes) FASTA records from a (possibly compressed) file, optionally restricted to records of the given boxes
+def read_fasta_records(fasta_file, prefixes=None):
+    with open_input(fasta_file, 'rb') as handle:
+        for seq_id, title, seq in read_fasta_with_titles(handle):
+            if prefixes is None or parse_prefix(seq_id) in prefixes:
+                yield seq_id, title, seq
+
+# Read FASTA records from a file, dropping exact (id, sequence) duplicates of records that were already kept
+# prefixes optionally restricts reading to records of the given boxes
+def read_deduplicated_records(fasta_file, seen_digests, seen_ids, dedup_stats, debug_stream, prefixes=None):
+    for seq_id, title, seq in read_fasta_records(fasta_file, prefixes):
+        status, log_line = deduplicate_record(seq_id, seq, os.path.basename(fasta_file), seen_digests, seen_ids, dedup_stats)
+        if log_line:
+            debug_stream.append(log_line)
+        if status != 'duplicate':
+            yield seq_id, title, seq
+
+# Load a QC workbook, which may be gzip- or zstd-compressed (decompressed in memory, without a temporary copy)
+def load_qc_workbook(file_path, read_only=False):
+    if compression_type(file_path) is None:
+        return openpyxl.load_workbook(file_path, read_only=read_only)
+    data = read_input_bytes(file_path)
+    if strip_compression_extension(file_path).endswith('.xls'):
+        # Compressed .xls files can't be converted in place, so copy their rows into a new workbook instead
+        df = pd.read_excel(data)
+        df = df.astype(object).where(df.notna(), None)
+        wb = openpyxl.Workbook()
+        wb.active.append(list(df.columns))
+        for row in df.itertuples(index=False):
+            wb.active.append(list(row))
+        return wb
+    return openpyxl.load_workbook(data, read_only=read_only)
+
 def convert_xls_to_xlsx(xls_path):
 # Define the new .xlsx file path
     xlsx_path = xls_path + 'x'
@@ -75,34 +172,20 @@ def save_histogram(category_counts, output_dir):
     print(f"Histogram saved to {histogram_path}")
     plt.close()
 
-def print_final_pair_categories(pairs, debug_stream):
+def print_final_pair_categories(pair_store, debug_stream):
     print("Final Categories for Sequence Pairs:")
-    for base_id, categories in pairs.items():
-        if 'b' in categories and 'a' in categories:
-            final_category = max(categories.values())
-            print(f"Pair {base_id} (Heavy Chain: Category {categories['b']}, Light Chain: Category {categories['a']}) - Final Category: {final_category}")
-            debug_stream.append(f"Pair {base_id} (Heavy Chain: Category {categories['b']}, Light Chain: Category {categories['a']}) - Final Category: {final_category}")
-        elif 'b' in categories:
-            print(f"Pair {base_id} (Heavy Chain: Category {categories['b']}, Light Chain: MISSING) - Final Category: 7")
-            debug_stream.append(f"Pair {base_id} (Heavy Chain: Category {categories['b']}, Light Chain: MISSING) - Final Category: 7")
-        elif 'a' in categories:
-            print(f"Pair {base_id} (Heavy Chain: MISSING, Light Chain: Category {categories['a']}) - Final Category: 7")
-            debug_stream.append(f"Pair {base_id} (Heavy Chain: MISSING, Light Chain: Category {categories['a']}) - Final Category: 7")
-        else:
-            print(f"Pair {base_id} (Heavy Chain: MISSING, Light Chain: MISSING) - Final Category: 7")
-            debug_stream.append(f"Pair {base_id} (Heavy Chain: MISSING, Light Chain: MISSING) - Final Category: 7")
-
-def plot_quality_scatter(pairs, output_dir):
+    for base_id, heavy, light in pair_store.items():
+        final_category = max(heavy, light)
+        print(f"Pair {base_id} (Heavy Chain: Category {heavy}, Light Chain: Category {light}) - Final Category: {final_category}")
+        debug_stream.append(f"Pair {base_id} (Heavy Chain: Category {heavy}, Light Chain: Category {light}) - Final Category: {final_category}")
+
+# frequency_matrix holds pair counts indexed [heavy category - 1, light category - 1] (see PairStore.quality_matrices)
+def plot_quality_scatter(frequency_matrix, output_dir):
     # Prepare a dictionary to count occurrences of quality pairs
     quality_pair_counts = {}
-    
-    # Iterate through pairs and count quality categories
-    for base_id, categories in pairs.items():
-        if 'b' in categories and 'a' in categories:
-            pair = (categories['a'], categories['b'])
-            if pair not in quality_pair_counts:
-                quality_pair_counts[pair] = 0
-            quality_pair_counts[pair] += 1
+    for (y_index, x_index), count in np.ndenumerate(frequency_matrix):
+        if count:
+            quality_pair_counts[(x_index + 1, y_index + 1)] = int(count)
 
     # Prepare data for plotting
     light_chain_qualities = [pair[0] for pair in quality_pair_counts]
@@ -128,43 +211,17 @@ def plot_quality_scatter(pairs, output_dir):
     print(f"Scatterplot saved to {scatterplot_path}")
 
 
-def plot_quality_heatmap(pairs, output_dir):
-    # Initial setup for the combined heatmap
-    max_category = 7  # Since categories range from 1 to 7
-    combined_frequency_matrix = np.zeros((max_category, max_category))
-    combined_total_counts = 0
-
-    # Categorize pairs by prefix
-    prefix_dict = {}
-    for base_id, categories in pairs.items():
-        prefix = base_id.split('-')[0]  # Extract prefix
-        if prefix not in prefix_dict:
-            prefix_dict[prefix] = {}
-        prefix_dict[prefix][base_id] = categories
-
-        # Populate the combined frequency matrix
-        if 'b' in categories and 'a' in categories:
-            y_index = categories['b'] - 1
-            x_index = categories['a'] - 1
-            combined_frequency_matrix[y_index, x_index] += 1
-            combined_total_counts += 1
+# prefix_matrices maps each prefix to its heavy x light category frequency matrix (see PairStore.quality_matrices)
+def plot_quality_heatmap(prefix_matrices, output_dir):
+    max_category = MAX_CATEGORY  # Since categories range from 1 to 7
 
     # Generate and save the combined heatmap
-    save_heatmap(combined_frequency_matrix, combined_total_counts, max_category, output_dir, 'All Boxes')
+    combined_frequency_matrix = sum(prefix_matrices.values(), np.zeros((max_category, max_category)))
+    save_heatmap(combined_frequency_matrix, combined_frequency_matrix.sum(), max_category, output_dir, 'All Boxes')
 
     # Generate and save heatmaps for each prefix
-    for prefix, prefixed_pairs in prefix_dict.items():
-        frequency_matrix = np.zeros((max_category, max_category))
-        total_counts = 0
-
-        for base_id, categories in prefixed_pairs.items():
-            if 'b' in categories and 'a' in categories:
-                y_index = categories['b'] - 1
-                x_index = categories['a'] - 1
-                frequency_matrix[y_index, x_index] += 1
-                total_counts += 1
-
-        save_heatmap(frequency_matrix, total_counts, max_category, output_dir, prefix)
+    for prefix, frequency_matrix in prefix_matrices.items():
+        save_heatmap(frequency_matrix, frequency_matrix.sum(), max_category, output_dir, prefix)
 
 def save_heatmap(frequency_matrix, total_counts, max_category, output_dir, prefix):
     fig, ax = plt.subplots(figsize=(10, 8))
@@ -195,7 +252,12 @@ def save_heatmap(frequency_matrix, total_counts, max_category, output_dir, prefi
 # (II) Input directory folder containing FASTA sequence files
 # (III) Output directory folder for triaged sequence FASTA files, QC Excel file with category labels, and log.txt 
 # Note: Script will combine Excel QC files into a single Excel file, and FASTA sequence files into a single FASTA file, exporting both to the output directory   
-def process_antibody_data():
+# Set sequence_metrics=True to add sequence composition metrics to the QC output and apply metric_criteria during triage
+# Set index_db to a SQLite file path to record the run's pair categories in the triage index
+# Set out_of_core=True to triage one box at a time for runs larger than RAM
+# Set clonotype_clustering=True to write near-duplicate clonotype clusters of the CLUSTER_CATEGORIES pairs to Clonotype_clusters.tsv
+# Set partitioned_output=True to also write per-category, per-box FASTA shards with a manifest to partitioned_sequences/
+def process_antibody_data(sequence_metrics=SEQUENCE_METRICS, metric_criteria=METRIC_CRITERIA, index_db=TRIAGE_INDEX_DB, out_of_core=OUT_OF_CORE, clonotype_clustering=CLONOTYPE_CLUSTERING, partitioned_output=PARTITIONED_OUTPUT):
     root = tk.Tk()
     root.withdraw()
     QC_file_dir = filedialog.askdirectory(title='Select directory containing Excel QC files') # (I)
@@ -203,7 +265,14 @@ def process_antibody_data():
     output_dir = filedialog.askdirectory(title='Select Output Directory') # (III)
     if not QC_file_dir or not fasta_file_dir or not output_dir:
         return print("Directory selection incomplete or incorrect file format, exiting the script.")
+    run_triage(QC_file_dir, fasta_file_dir, output_dir, sequence_metrics=sequence_metrics, metric_criteria=metric_criteria, index_db=index_db, out_of_core=out_of_core, clonotype_clustering=clonotype_clustering, partitioned_output=partitioned_output)
 
+# Triage core shared by the file dialog entry point and watch_triage.py
+# prefixes optionally restricts the run to QC rows and FASTA records of the given boxes (e.g. {'B1', 'B3'})
+# Returns the total pair counts per category
+def run_triage(QC_file_dir, fasta_file_dir, output_dir, sequence_metrics=SEQUENCE_METRICS, metric_criteria=METRIC_CRITERIA, prefixes=None, index_db=TRIAGE_INDEX_DB, out_of_core=OUT_OF_CORE, clonotype_clustering=CLONOTYPE_CLUSTERING, partitioned_output=PARTITIONED_OUTPUT):
+    if out_of_core:
+        return run_partitioned_triage(QC_file_dir, fasta_file_dir, output_dir, sequence_metrics, metric_criteria, prefixes, index_db, clonotype_clustering, partitioned_output)
 
     '''COMBINE FILES FROM INPUT DIRECTORIES'''
     # Initialize main workbook and sheet
@@ -211,38 +280,49 @@ def process_antibody_data():
     main_ws = main_wb.active
     main_ws.title = "Combined QC Data"
     first_file = True
+    debug_output = [] # Initialize debugging output list stream
 
     # convert .xls to .xlsx as needed
     for file_path in glob.glob(os.path.join(QC_file_dir, '*.*')):
         if file_path.endswith('.xls'):
             file_path = convert_xls_to_xlsx(file_path) # Convert .xls to .xlsx, and delete old .xls files
 
-    # Process all .xlsx Excel files
+    # Process all .xlsx Excel files (plain or compressed)
     for file_path in glob.glob(os.path.join(QC_file_dir, '*.*')):
-        wb = openpyxl.load_workbook(file_path)
+        wb = load_qc_workbook(file_path)
         ws = wb.active
         if first_file:
             header = [cell.value for cell in ws[1]]  # Extract header from the first file
             main_ws.append(header)  # Append the header to the main worksheet
             first_file = False
+        if prefixes is not None:
+            template_index = [cell.value for cell in ws[1]].index('TemplateName')
         for row in ws.iter_rows(min_row=2, values_only=True):  # Skip the header row for remaining files
-            main_ws.append(row)
+            if prefixes is None or parse_prefix(row[template_index]) in prefixes:
+                main_ws.append(row)
 
     # Ensure header is added
     if main_ws.max_row == 1:  # Only header row present
         for cell in ws[1]:  # Take header from the last processed workbook
             main_ws.cell(row=1, column=cell.column, value=cell.value)
 
-    # Process all FASTA files
+    # Process all FASTA files, dropping exact duplicates from re-exports and re-reads
     all_sequences = []
-    file_extensions = ['*.fasta', '*.txt']
+    seen_digests = set() # Compact digests of every (id, sequence) pair kept so far
+    seen_ids = {} # Sequence id -> digest of the first sequence kept for that id
+    dedup_stats = {'duplicates': 0, 'conflicts': 0}
+    file_extensions = compressed_patterns(['*.fasta', '*.txt']) # Plain, .gz and .zst FASTA files
     for file_pattern in file_extensions:
         for fasta_file in glob.glob(os.path.join(fasta_file_dir, file_pattern)):
             # print(f"Reading file: {fasta_file}")  # Debug print to check if files are being read
-            for record in SeqIO.parse(fasta_file, "fasta"):
+            for record in read_deduplicated_records(fasta_file, seen_digests, seen_ids, dedup_stats, debug_output, prefixes):
                 all_sequences.append(record)
             print(f"Found {len(all_sequences)} sequences after reading {fasta_file}")  # Debug print to check sequence accumulation
 
+    # Print and log deduplication statistics
+    print(f"FASTA deduplication: {len(all_sequences)} unique records kept, {dedup_stats['duplicates']} exact duplicates dropped, {dedup_stats['conflicts']} id conflicts")
+    debug_output.append(f"FASTA deduplication: {len(all_sequences)} unique records kept, {dedup_stats['duplicates']} exact duplicates dropped, {dedup_stats['conflicts']} id conflicts")
+
         
     # Save the combined Excel workbook
     combined_excel_path = os.path.join(output_dir, "Combined_qc_data.xlsx")
@@ -250,7 +330,7 @@ def process_antibody_data():
 
     # Save all sequences to a single FASTA file
     combined_fasta_path = os.path.join(output_dir, "Combined_sequences.fasta")
-    SeqIO.write(all_sequences, combined_fasta_path, "fasta")
+    write_fasta(((title, seq) for _, title, seq in all_sequences), combined_fasta_path)
 
 
     '''BEGIN PROCESSING COMBINED INPUT FILES'''
@@ -259,92 +339,174 @@ def process_antibody_data():
     header = [cell.value for cell in ws[1]]  # Existing headers from the first row
     if 'Chain Category' not in header:
         header.extend(['Chain Category', 'Pair Category']) # Add new columns for Triage Category labels
-        for col_index, header_title in enumerate(header, start=1):
-            ws.cell(row=1, column=col_index, value=header_title)
+    if sequence_metrics:
+        header.extend([column for column in METRIC_COLUMNS if column not in header]) # Add missing columns for sequence composition metrics
+    for col_index, header_title in enumerate(header, start=1):
+        ws.cell(row=1, column=col_index, value=header_title)
+
+    # Triage all QC entries and FASTA sequences together
+    qc_rows = [(row_number, row[header.index('TemplateName')], row[header.index('CRL')], row[header.index('QualitySCore')])
+               for row_number, row in enumerate(ws.iter_rows(min_row=2, max_row=ws.max_row, values_only=True), start=2)]
+    fasta_records = [(sequence_number, seq_id, seq) for sequence_number, (seq_id, _, seq) in enumerate(all_sequences)]
+    triage = triage_records(qc_rows, fasta_records, sequence_metrics, metric_criteria)
+    pairs = triage['pairs']
+    if sequence_metrics:
+        print(f"Computed sequence metrics for {len(fasta_records)} records, {triage['metrics_failing']} failing metric criteria")
+        debug_output.append(f"Computed sequence metrics for {len(fasta_records)} records, {triage['metrics_failing']} failing metric criteria")
+    for phase in TRIAGE_LOG_PHASES:
+        debug_output.extend(line for _, line in triage['log'][phase])
+
+    # Add 'Chain Category', 'Pair Category' (and sequence metric) values to Excel output file
+    for row_number, values in triage['row_values'].items():
+        for column, value in values.items():
+            ws.cell(row=row_number, column=header.index(column) + 1, value=value)
+
+    quality_matrices = pairs.quality_matrices()
+    plot_quality_scatter(sum(quality_matrices.values(), np.zeros((MAX_CATEGORY, MAX_CATEGORY))), output_dir) # plot scatterplot
+    plot_quality_heatmap(quality_matrices, output_dir) # plot heatmap
 
-    pairs = {} # Initialize pairs dictionary, which contains a category value for the heavy and light chain for each sequence id key
-    seq_subsets = {i: [] for i in range(1, 8)}  # 8 is not inclusive, therefore this range goes up to Category 7
-    debug_output = [] # Initialize debugging output list stream
-    fasta_sequence_ids = set()  # Set to track sequence IDs from FASTA files
+    # Save sequences to separate output FASTA files in user-designated output directory
+    shard_summary = write_category_fasta_files(((seq_id, seq, pair_category) for (_, seq_id, seq), pair_category in zip(fasta_records, triage['fasta_categories'])), output_dir, partitioned_output)
+
+    # Organize pairs by prefix, then count, print and log category statistics
+    total_category_counts = log_category_statistics(pairs.prefix_category_counts(), debug_output)
+    
+    #summarize_category_statistics(pairs, debug_output)
+
+    # Record this run's pair categories in the SQLite triage index, keyed by the output directory
+    if index_db:
+        indexed_count = upsert_pairs(index_db, pairs, os.path.abspath(output_dir))
+        print(f"Indexed {indexed_count} pairs in {index_db}")
+        debug_output.append(f"Indexed {indexed_count} pairs in {index_db}")
+
+    # Group near-identical sibling clones across boxes from the category FASTA files
+    if clonotype_clustering:
+        cluster_category_files(output_dir, CLUSTER_CATEGORIES, debug_output=debug_output)
+    if shard_summary:
+        print(shard_summary)
+        debug_output.append(shard_summary)
+
+    # Save the modified Excel workbook (which includes the 2 new Category columns) in user-designated output directory
+    new_excel_file_name = 'COMBINED_QC_DATA_WITH_CATEGORIES.xlsx'
+    new_file_path = os.path.join(output_dir, new_excel_file_name)
+    wb.save(new_file_path)    
+
+    # Save debugging output to log file in user-designated output directory
+    write_log(os.path.join(output_dir, 'Triage_log.txt'), debug_output)
+    save_histogram(total_category_counts, output_dir) # generate and save histogram of results to output directory
+
+    print("Files and logs have been successfully saved to the selected directory.")
+
+    # DEBUGGING
+    # print_final_pair_categories(pairs, debug_output)
+    # print(f"Pairs: {pairs}")
+    return total_category_counts
+
+# Log phases of triage_records, in the order they appear in Triage_log.txt
+TRIAGE_LOG_PHASES = ['qc_entries', 'missing_qc', 'missing_fasta', 'qc_pairing', 'fasta_sequences']
+
+# Triage one set of QC entries and kept FASTA records: a whole run, or one box partition of an out-of-core run
+# qc_rows are (row_number, TemplateName, CRL, QualitySCore) in QC order; fasta_records are (sequence_number, id, sequence) in FASTA order
+# Returns a dictionary with the PairStore ('pairs'), the values to write into each QC row ('row_values', {row_number: {column: value}}),
+# the Pair Category of each FASTA record ('fasta_categories'), the number of records failing the metric criteria ('metrics_failing')
+# and the log lines of each triage phase as (ordering key, line) tuples ('log')
+def triage_records(qc_rows, fasta_records, sequence_metrics=False, metric_criteria=METRIC_CRITERIA):
+    pairs = PairStore() # Compact pair store, which contains a category value for the heavy and light chain (and which chains have FASTA sequences) for each base_id
+    row_values = {}
+    log = {phase: [] for phase in TRIAGE_LOG_PHASES}
+    pair_first_rows = [] # Row number of the first QC entry of each pair, used to order its log lines
+
+    # Compute sequence composition metrics for every kept record in vectorized chunks
+    chain_metric_index = {} # full_id -> index of its first FASTA record in the metric arrays
+    metrics_failing = 0
+    if sequence_metrics:
+        metrics = compute_sequence_metrics([seq for _, _, seq in fasta_records])
+        failing_chains = failing_metric_criteria(metrics, metric_criteria)
+        metrics_failing = int(failing_chains.sum())
+        for index, (_, seq_id, _) in enumerate(fasta_records):
+            _, full_id, _ = parse_identifier(seq_id)
+            if full_id and full_id not in chain_metric_index:
+                chain_metric_index[full_id] = index
 
     # Process QC data entries and assign Chain Category in the QC data (but not Pair Category yet)
-    for row in ws.iter_rows(min_row=2, max_row=ws.max_row, values_only=False):
-        template_name = row[header.index('TemplateName')].value
-        crl = row[header.index('CRL')].value
-        qs = row[header.index('QualitySCore')].value
+    for row_number, template_name, crl, qs in qc_rows:
         base_id, full_id, chain_type = parse_identifier(template_name)
         if full_id: # Check if the row has an id
             category = determine_category(crl, qs)
-            if base_id not in pairs: 
-                pairs[base_id] = {'b': 7, 'a': 7}  # Initialize as Category 7 if TemplateName id not yet an entry (applies to QC entries only, at this point)
-            pairs[base_id][chain_type] = min(pairs[base_id].get(chain_type, 7), category) # Set as highest quality category (smallest #) from multiple reads of a single sequence chain (a.k.a single full_id)
-            row[header.index('Chain Category')].value = category  # Add 'Chain Category' value to Excel output file
-            debug_output.append(f"QC Entry: {template_name}, CRL: {crl}, QS: {qs}, Chain: {chain_type}, Chain Category: {category}")
+            values = row_values.setdefault(row_number, {})
+            if full_id in chain_metric_index: # Only populated when sequence metrics are enabled
+                metric_index = chain_metric_index[full_id]
+                values.update(zip(METRIC_COLUMNS, metric_row(metrics, metric_index))) # Add sequence metric values to Excel output file
+                if failing_chains[metric_index] and category != 7:
+                    category = 7 # Chain fails the extra metric triage criteria
+                    log['qc_entries'].append((row_number, f"QC Entry: {template_name} fails sequence metric criteria, assigned Category 7"))
+            pair_index = pairs.add(base_id)  # Initialize as Category 7 if TemplateName id not yet an entry (applies to QC entries only, at this point)
+            if pair_index == len(pair_first_rows):
+                pair_first_rows.append(row_number)
+            pairs.update_chain(pair_index, chain_type, category) # Set as highest quality category (smallest #) from multiple reads of a single sequence chain (a.k.a single full_id)
+            values['Chain Category'] = category  # Add 'Chain Category' value to Excel output file
+            log['qc_entries'].append((row_number, f"QC Entry: {template_name}, CRL: {crl}, QS: {qs}, Chain: {chain_type}, Chain Category: {category}"))
 
     # Identify which FASTA sequences are missing QC entries (don't initialize yet since that throws off the debugging output)
-    for sequence in SeqIO.parse(combined_fasta_path, "fasta"):
-        base_id, full_id, chain_type = parse_identifier(sequence.id) # Parse FASTA sequence id strings   
-        fasta_sequence_ids.add(full_id) # keep track of full_ID (i.e. specific chains)
+    for sequence_number, seq_id, _ in fasta_records:
+        base_id, full_id, chain_type = parse_identifier(seq_id) # Parse FASTA sequence id strings   
         # print(f"debug: {full_id}")
-        if base_id not in pairs: # a.k.a sequences that are missing QC entries
+        if base_id in pairs:
+            pairs.mark_fasta(pairs.index[base_id], chain_type) # keep track of which chains of QC pairs have FASTA sequences
+        else: # a.k.a sequences that are missing QC entries
             print(f"{base_id} pair missing QC entry!")
-            debug_output.append(f"{base_id} pair missing QC entry!") 
+            log['missing_qc'].append((sequence_number, f"{base_id} pair missing QC entry!"))
 
-    # print(fasta_sequence_ids)
     # Identify which QC entries are missing FASTA sequences
-    for base_id in pairs:
-        for chain_type in ['b', 'a']:
-            full_id = f"{base_id}{chain_type}"
-            # print(full_id)
-            if full_id not in fasta_sequence_ids:
-                pairs[base_id][chain_type] = 7
+    for pair_index, base_id in enumerate(pairs.base_ids):
+        for chain_type, chain_flag in [('b', HEAVY_FASTA), ('a', LIGHT_FASTA)]:
+            if not pairs.fasta_chains[pair_index] & chain_flag:
+                pairs.reset_chain(pair_index, chain_type)
                 print(f"{chain_type}{base_id} QC entry has no matching FASTA sequence!")
-                debug_output.append(f"{base_id}{chain_type} QC entry has no matching FASTA sequence!")
+                log['missing_fasta'].append((pair_first_rows[pair_index], f"{base_id}{chain_type} QC entry has no matching FASTA sequence!"))
 
     # Identify Pair Category for QC Pairs
-    for row in ws.iter_rows(min_row=2, max_row=ws.max_row, values_only=False):
-        template_name = row[header.index('TemplateName')].value
+    for row_number, template_name, _, _ in qc_rows:
         base_id, _, _ = parse_identifier(template_name)
-        if base_id in pairs and 'b' in pairs[base_id] and 'a' in pairs[base_id]:
-            pair_category = max(pairs[base_id].values()) # Assign lower quality category (larger #) from between the heavy and light chain of the base_id 
-            row[header.index('Pair Category')].value = pair_category # Add 'Pair Category' value to Excel output file
-            debug_output.append(f"QC H/L Chain Pairing: {template_name}, Pair Category: {pair_category}, Determined by: {'H' if pairs[base_id]['b'] == pair_category else 'L'}")
+        if base_id in pairs:
+            pair_index = pairs.index[base_id]
+            pair_category = pairs.pair_category(pair_index) # Assign lower quality category (larger #) from between the heavy and light chain of the base_id 
+            row_values.setdefault(row_number, {})['Pair Category'] = pair_category # Add 'Pair Category' value to Excel output file
+            log['qc_pairing'].append((row_number, f"QC H/L Chain Pairing: {template_name}, Pair Category: {pair_category}, Determined by: {'H' if pairs.heavy[pair_index] == pair_category else 'L'}"))
 
     # Identify Pair Category for FASTA Pairs
-    for sequence in SeqIO.parse(combined_fasta_path, "fasta"):
-        base_id, full_id, chain_type = parse_identifier(sequence.id) # Parse FASTA sequence id strings      
-        if base_id not in pairs: 
-            pairs[base_id] = {'b': 7, 'a': 7}  # At this point, initialize missing pairs if not in pairs from Excel , these will be same as "pair missing QC entry"
-        pair_category = max(pairs[base_id].values()) # Assign lower quality category (larger #) from between the heavy and light chain of the base_id 
-        seq_subsets[pair_category].append((sequence.id, str(sequence.seq))) # Add triaged sequence to category-specific FASTA file
-        debug_output.append(f"FASTA Sequence: {sequence.id}, Pair Category: {pair_category}")
-    
-    plot_quality_scatter(pairs, output_dir) # plot scatterplot
-    plot_quality_heatmap(pairs, output_dir) # plot heatmap
-
-    # Save sequences to separate output FASTA files in user-designated output directory
-    for index, sequences in seq_subsets.items():
-        file_name = f'Category_{index}_paired_sequences.fasta'
-        with open(os.path.join(output_dir, file_name), 'w') as file:
-            for seq_id, seq in sequences:
-                file.write(f'>{seq_id}\n{seq}\n')
-
-    category_counts = {i: 0 for i in range(1, 8)}  # Initialize counts to 0 for categories 1 to 7
-
-    # Initialize the dictionary to store category counts for each prefix
-    prefix_category_counts = {}
-    total_category_counts = {i: 0 for i in range(1, 8)}  # Initialize total counts across all prefixes
-
-    # Organize pairs by prefix and count categories
-    for base_id, categories in pairs.items():
-        prefix = base_id.split('-')[0]
-        if prefix not in prefix_category_counts:
-            prefix_category_counts[prefix] = {i: 0 for i in range(1, 8)}
-
-        if 'b' in categories and 'a' in categories:
-            final_category = max(categories.values())
-            prefix_category_counts[prefix][final_category] += 1
-            total_category_counts[final_category] += 1
+    fasta_categories = np.zeros(len(fasta_records), dtype=np.uint8)
+    for index, (sequence_number, seq_id, _) in enumerate(fasta_records):
+        base_id, full_id, chain_type = parse_identifier(seq_id) # Parse FASTA sequence id strings      
+        pair_index = pairs.add(base_id)  # At this point, initialize missing pairs if not in pairs from Excel , these will be same as "pair missing QC entry"
+        pair_category = pairs.pair_category(pair_index) # Assign lower quality category (larger #) from between the heavy and light chain of the base_id 
+        fasta_categories[index] = pair_category # Add triaged sequence to category-specific FASTA file
+        log['fasta_sequences'].append((sequence_number, f"FASTA Sequence: {seq_id}, Pair Category: {pair_category}"))
+
+    return {'pairs': pairs, 'row_values': row_values, 'fasta_categories': fasta_categories, 'metrics_failing': metrics_failing, 'log': log}
+
+# Write (id, sequence, Pair Category) records to the seven Category_N_paired_sequences.fasta files
+# With partitioned=True each record is also written to its (category, prefix) shard in the same pass
+# Returns the shard summary line to log, or None
+def write_category_fasta_files(categorized_records, output_dir, partitioned=PARTITIONED_OUTPUT):
+    category_files = {index: open(os.path.join(output_dir, f'Category_{index}_paired_sequences.fasta'), 'wb') for index in range(1, 8)}
+    shard_writer = FastaShardWriter(output_dir) if partitioned else None
+    try:
+        for seq_id, seq, pair_category in categorized_records:
+            write_fasta_record(category_files[pair_category], seq_id, seq, wrap=None)
+            if shard_writer:
+                shard_writer.write(pair_category, parse_prefix(seq_id), seq_id, seq)
+    finally:
+        for file in category_files.values():
+            file.close()
+    if shard_writer:
+        manifest_path = shard_writer.close()
+        return f"Wrote {len(shard_writer.shards)} category/prefix FASTA shards to {SHARD_DIR_NAME}, manifest saved to {manifest_path}"
+    return None
+
+# Print and log category statistics for each prefix and across all prefixes, returning the total counts per category
+def log_category_statistics(prefix_category_counts, debug_output):
+    total_category_counts = {i: sum(counts[i] for counts in prefix_category_counts.values()) for i in range(1, 8)}  # Total counts across all prefixes
 
     # Print and log category statistics for each prefix
     print("Category Statistics by Prefix:")
@@ -370,25 +532,269 @@ def process_antibody_data():
         debug_output.append(f"Category {category}: {count} pairs, {percent:.2f}%")
     print(f"Total Pairs across all prefixes: {total_pairs}")
     debug_output.append(f"Total Pairs across all prefixes: {total_pairs}")
-    
-    #summarize_category_statistics(pairs, debug_output)
+    return total_category_counts
+
+# Append one item to a pickle spill file of the out-of-core triage
+def spill(spill_file, item):
+    pickle.dump(item, spill_file, protocol=pickle.HIGHEST_PROTOCOL)
+
+# Stream the items of a spill file back in the order they were written
+def read_spill(spill_path):
+    if not os.path.exists(spill_path):
+        return
+    with open(spill_path, 'rb') as spill_file:
+        while True:
+            try:
+                yield pickle.load(spill_file)
+            except EOFError:
+                return
+
+# Merge the sorted spill files of all partitions into one stream ordered by each item's first field (row or sequence number)
+# At most fan_in files are open at once: larger merges first combine groups of fan_in files into intermediate spill files
+def merge_spills(spill_paths, fan_in=MERGE_FAN_IN):
+    spill_paths = [spill_path for spill_path in spill_paths if os.path.exists(spill_path)]
+    intermediate_paths = set()
+    while len(spill_paths) > fan_in:
+        merged_paths = []
+        for start in range(0, len(spill_paths), fan_in):
+            group = spill_paths[start:start + fan_in]
+            merged_fd, merged_path = tempfile.mkstemp(suffix='.merge', dir=os.path.dirname(group[0]))
+            with os.fdopen(merged_fd, 'wb') as merged_file:
+                for item in heapq.merge(*[read_spill(spill_path) for spill_path in group], key=lambda item: item[0]):
+                    spill(merged_file, item)
+            for spill_path in group:
+                if spill_path in intermediate_paths:  # Partition spill files are kept, they can be merged again
+                    os.remove(spill_path)
+            intermediate_paths.add(merged_path)
+            merged_paths.append(merged_path)
+        spill_paths = merged_paths
+    return heapq.merge(*[read_spill(spill_path) for spill_path in spill_paths], key=lambda item: item[0])
+
+# Close the worksheets of a write-only workbook that was not saved, so their row streams are finished before the workbook
+# is dropped (openpyxl removes the closed worksheets' temporary files when Python exits)
+def discard_workbook(wb):
+    if wb is None:
+        return
+    for ws in wb.worksheets:
+        if ws.closed:
+            continue
+        try:
+            ws.close()
+        except OSError as e:  # Temporary file not writable, e.g. disk full: keep the error that stopped the run
+            print(f"Could not close unsaved worksheet {ws.title}: {e}")
+
+# Out-of-core triage: same inputs, outputs and statistics as run_triage, with peak memory bounded by the largest box
+# (1) QC rows and FASTA records are streamed into the combined files' inputs and spilled into per-prefix partition files
+# (2) each partition is deduplicated and triaged on its own with triage_records (pairing never crosses a base_id, so never a box)
+# (3) the per-partition results are merged back in the original QC row / FASTA record order to write the outputs
+def run_partitioned_triage(QC_file_dir, fasta_file_dir, output_dir, sequence_metrics=SEQUENCE_METRICS, metric_criteria=METRIC_CRITERIA, prefixes=None, index_db=TRIAGE_INDEX_DB, clonotype_clustering=CLONOTYPE_CLUSTERING, partitioned_output=PARTITIONED_OUTPUT):
+    partition_dir = tempfile.mkdtemp(prefix='.triage_partitions_', dir=output_dir)
+    partitions = {} # prefix -> {'path': partition file prefix, 'first_qc_row': row number, 'first_record': sequence number}
+    spill_files = OrderedDict()  # (prefix, kind) -> open spill file, in least recently written order
+    created_files = set()
+    main_wb = new_wb = None
+
+    # Open (or reuse) the spill file of one kind for a partition, keeping at most MAX_OPEN_SPILL_FILES open
+    def partition_file(prefix, kind):
+        if prefix not in partitions:
+            partitions[prefix] = {'path': os.path.join(partition_dir, f'partition_{len(partitions)}'), 'first_qc_row': None, 'first_record': None}
+        key = (prefix, kind)
+        if key in spill_files:
+            spill_files.move_to_end(key)
+            return spill_files[key]
+        if len(spill_files) >= MAX_OPEN_SPILL_FILES:
+            _, oldest = spill_files.popitem(last=False)
+            oldest.close()
+        spill_files[key] = open(f"{partitions[prefix]['path']}.{kind}", 'ab' if key in created_files else 'wb')
+        created_files.add(key)
+        return spill_files[key]
 
-    # Save the modified Excel workbook (which includes the 2 new Category columns) in user-designated output directory
-    new_excel_file_name = 'COMBINED_QC_DATA_WITH_CATEGORIES.xlsx'
-    new_file_path = os.path.join(output_dir, new_excel_file_name)
-    wb.save(new_file_path)    
-
-    # Save debugging output to log file in user-designated output directory
-    log_file_path = os.path.join(output_dir, 'Triage_log.txt')
+    try:
+        '''SPILL INPUT FILES INTO PREFIX PARTITIONS'''
+        # Stream QC rows into the combined workbook and their prefix partitions
+        main_wb = openpyxl.Workbook(write_only=True)
+        main_ws = main_wb.create_sheet("Combined QC Data")
+        header = None
+        last_header = None
+        row_number = 1
+
+        # convert .xls to .xlsx as needed
+        for file_path in glob.glob(os.path.join(QC_file_dir, '*.*')):
+            if file_path.endswith('.xls'):
+                file_path = convert_xls_to_xlsx(file_path) # Convert .xls to .xlsx, and delete old .xls files
+
+        for file_path in glob.glob(os.path.join(QC_file_dir, '*.*')):
+            wb = load_qc_workbook(file_path, read_only=True)
+            rows = wb.active.iter_rows(values_only=True)
+            last_header = list(next(rows, ()))
+            if header is None:
+                header = last_header  # Extract header from the first file
+            template_index = last_header.index('TemplateName') if prefixes is not None else None
+            for row in rows:
+                if prefixes is not None and parse_prefix(row[template_index]) not in prefixes:
+                    continue
+                if row_number == 1:
+                    main_ws.append(header)
+                main_ws.append(row)
+                row_number += 1
+                values = [row[header.index(column)] if header.index(column) < len(row) else None for column in ('TemplateName', 'CRL', 'QualitySCore')]
+                base_id, _, _ = parse_identifier(values[0])
+                if base_id:
+                    prefix = base_id.split('-')[0]
+                    spill(partition_file(prefix, 'qc'), (row_number, *values))
+                    if partitions[prefix]['first_qc_row'] is None:
+                        partitions[prefix]['first_qc_row'] = row_number
+            wb.close()
+        if row_number == 1: # Only header row present, take header from the last processed workbook
+            main_ws.append(last_header)
+        combined_excel_path = os.path.join(output_dir, "Combined_qc_data.xlsx")
+        main_wb.save(combined_excel_path)
+        main_wb = None
+
+        # Stream FASTA records into their prefix partitions, numbered in reading order
+        sequence_number = 0
+        file_extensions = compressed_patterns(['*.fasta', '*.txt']) # Plain, .gz and .zst FASTA files
+        for file_pattern in file_extensions:
+            for fasta_file in glob.glob(os.path.join(fasta_file_dir, file_pattern)):
+                for seq_id, title, seq in read_fasta_records(fasta_file, prefixes):
+                    base_id, _, _ = parse_identifier(seq_id)
+                    prefix = base_id.split('-')[0] if base_id else None
+                    spill(partition_file(prefix, 'fasta'), (sequence_number, os.path.basename(fasta_file), title, seq_id, seq))
+                    if partitions[prefix]['first_record'] is None:
+                        partitions[prefix]['first_record'] = sequence_number
+                    sequence_number += 1
+                print(f"Spilled {sequence_number} sequences after reading {fasta_file}")
+        for spill_file in spill_files.values():
+            spill_file.close()
+        spill_files.clear()
+
+        '''TRIAGE ONE PARTITION AT A TIME'''
+        # Boxes with QC entries come first, in QC order, then FASTA-only boxes in FASTA order (the in-memory pair order)
+        ordered_partitions = sorted(partitions.values(), key=lambda partition: (partition['first_qc_row'] is None, partition['first_qc_row'] if partition['first_qc_row'] is not None else partition['first_record']))
+        dedup_stats = {'duplicates': 0, 'conflicts': 0}
+        kept_count = 0
+        metrics_failing = 0
+        prefix_category_counts = {}
+        quality_matrices = {}
+        indexed_count = 0
+        for partition in ordered_partitions:
+            path = partition['path']
+            qc_rows = list(read_spill(f'{path}.qc'))
+
+            # Deduplicate within the partition: duplicates and conflicts share an id, so they always share a partition
+            seen_digests, seen_ids = set(), {}
+            kept_records = []
+            with open(f'{path}.dedup_log', 'wb') as dedup_log:
+                for number, source_name, title, seq_id, seq in read_spill(f'{path}.fasta'):
+                    status, log_line = deduplicate_record(seq_id, seq, source_name, seen_digests, seen_ids, dedup_stats)
+                    if log_line:
+                        spill(dedup_log, (number, log_line))
+                    if status != 'duplicate':
+                        kept_records.append((number, title, seq_id, seq))
+            del seen_digests, seen_ids
+            kept_count += len(kept_records)
+
+            triage = triage_records(qc_rows, [(number, seq_id, seq) for number, _, seq_id, seq in kept_records], sequence_metrics, metric_criteria)
+            metrics_failing += triage['metrics_failing']
+
+            # Spill the partition's results for the ordered merge
+            with open(f'{path}.rows', 'wb') as rows_file:
+                for number in sorted(triage['row_values']):
+                    spill(rows_file, (number, triage['row_values'][number]))
+            with open(f'{path}.categorized', 'wb') as categorized_file:
+                for (number, title, seq_id, seq), pair_category in zip(kept_records, triage['fasta_categories']):
+                    spill(categorized_file, (number, title, seq_id, seq, int(pair_category)))
+            for phase in TRIAGE_LOG_PHASES:
+                with open(f'{path}.{phase}', 'wb') as phase_file:
+                    for item in triage['log'][phase]:
+                        spill(phase_file, item)
+
+            # Accumulate statistics
+            pairs = triage['pairs']
+            prefix_category_counts.update(pairs.prefix_category_counts())
+            quality_matrices.update(pairs.quality_matrices())
+            if index_db:
+                indexed_count += upsert_pairs(index_db, pairs, os.path.abspath(output_dir))
+            del qc_rows, kept_records, triage, pairs
+
+        '''MERGE PARTITION RESULTS IN ORIGINAL ORDER'''
+        partition_paths = [partition['path'] for partition in ordered_partitions]
+        print(f"FASTA deduplication: {kept_count} unique records kept, {dedup_stats['duplicates']} exact duplicates dropped, {dedup_stats['conflicts']} id conflicts")
+
+        # Save all kept sequences to a single FASTA file
+        combined_fasta_path = os.path.join(output_dir, "Combined_sequences.fasta")
+        write_fasta(((title, seq) for _, title, _, seq, _ in merge_spills([f'{path}.categorized' for path in partition_paths])), combined_fasta_path)
+
+        # Save sequences to separate output FASTA files in user-designated output directory
+        shard_summary = write_category_fasta_files(((seq_id, seq, pair_category) for _, _, seq_id, seq, pair_category in merge_spills([f'{path}.categorized' for path in partition_paths])), output_dir, partitioned_output)
+
+        # Stream the combined QC rows into the annotated workbook, adding each row's Category (and sequence metric) values
+        combined_wb = openpyxl.load_workbook(combined_excel_path, read_only=True)
+        combined_rows = combined_wb.active.iter_rows(values_only=True)
+        header = list(next(combined_rows, ()))  # Existing headers from the first row
+        if 'Chain Category' not in header:
+            header.extend(['Chain Category', 'Pair Category']) # Add new columns for Triage Category labels
+        if sequence_metrics:
+            header.extend([column for column in METRIC_COLUMNS if column not in header]) # Add missing columns for sequence composition metrics
+        new_wb = openpyxl.Workbook(write_only=True)
+        new_ws = new_wb.create_sheet("Combined QC Data")
+        new_ws.append(header)
+        row_values = merge_spills([f'{path}.rows' for path in partition_paths])
+        next_values = next(row_values, None)
+        for number, row in enumerate(combined_rows, start=2):
+            row = list(row) + [None] * (len(header) - len(row))
+            if next_values is not None and next_values[0] == number:
+                for column, value in next_values[1].items():
+                    row[header.index(column)] = value
+                next_values = next(row_values, None)
+            new_ws.append(row)
+        combined_wb.close()
+        new_excel_file_name = 'COMBINED_QC_DATA_WITH_CATEGORIES.xlsx'
+        new_wb.save(os.path.join(output_dir, new_excel_file_name))
+        new_wb = None
+
+        combined_matrix = sum(quality_matrices.values(), np.zeros((MAX_CATEGORY, MAX_CATEGORY)))
+        plot_quality_scatter(combined_matrix, output_dir) # plot scatterplot
+        plot_quality_heatmap(quality_matrices, output_dir) # plot heatmap
+
+        # Organize pairs by prefix, then count, print and log category statistics
+        summary_output = [] # Only the small run summary is kept in memory, the per-entry log lines are merged from the partitions
+        total_category_counts = log_category_statistics(prefix_category_counts, summary_output)
+        if index_db:
+            print(f"Indexed {indexed_count} pairs in {index_db}")
+            summary_output.append(f"Indexed {indexed_count} pairs in {index_db}")
+        if clonotype_clustering:
+            cluster_category_files(output_dir, CLUSTER_CATEGORIES, debug_output=summary_output)
+        if shard_summary:
+            print(shard_summary)
+            summary_output.append(shard_summary)
+
+        # Save debugging output to log file in user-designated output directory, in the same order as the in-memory path
+        header_output = [f"FASTA deduplication: {kept_count} unique records kept, {dedup_stats['duplicates']} exact duplicates dropped, {dedup_stats['conflicts']} id conflicts"]
+        if sequence_metrics:
+            print(f"Computed sequence metrics for {kept_count} records, {metrics_failing} failing metric criteria")
+            header_output.append(f"Computed sequence metrics for {kept_count} records, {metrics_failing} failing metric criteria")
+        phase_lines = [(line for _, line in merge_spills([f'{path}.{phase}' for path in partition_paths])) for phase in TRIAGE_LOG_PHASES]
+        write_log(os.path.join(output_dir, 'Triage_log.txt'),
+                  (line for _, line in merge_spills([f'{path}.dedup_log' for path in partition_paths])), header_output, *phase_lines, summary_output)
+        save_histogram(total_category_counts, output_dir) # generate and save histogram of results to output directory
+
+        print("Files and logs have been successfully saved to the selected directory.")
+        return total_category_counts
+    finally:
+        for spill_file in spill_files.values():
+            spill_file.close()
+        discard_workbook(main_wb)
+        discard_workbook(new_wb)
+        shutil.rmtree(partition_dir, ignore_errors=True)
+
+# Write log lines from one or more line streams, newline-separated
+def write_log(log_file_path, *line_streams):
     with open(log_file_path, 'w') as log_file:
-        log_file.write('\n'.join(debug_output))
-    save_histogram(total_category_counts, output_dir) # generate and save histogram of results to output directory
-
-    print("Files and logs have been successfully saved to the selected directory.")
-
-    # DEBUGGING
-    # print_final_pair_categories(pairs, debug_output)
-    # print(f"Pairs: {pairs}")
+        for line_number, line in enumerate(itertools.chain(*line_streams)):
+            if line_number:
+                log_file.write('\n')
+            log_file.write(line)
 
 if __name__ == "__main__":
     process_antibody_data()